@@ -6,6 +6,9 @@ import pkgutil
 
 log = logging.getLogger(__name__)
 
+# Resolved connector modules, by (directory, module name)
+REGISTRY = dict()
+
 
 def detect_plugins():
     directory = os.sep.join(['sqapi', 'plugin', 'plugins'])
@@ -40,7 +43,7 @@ def detect_database(config):
         raise AttributeError(err)
 
 
-def detect_listener(config, processor_callback):
+def detect_listener(config, processor_callback, batch_callback=None):
     log.debug('Looking up listener type in configuration')
 
     target_module = config.get('type', 'rabbitmq')
@@ -49,7 +52,7 @@ def detect_listener(config, processor_callback):
     try:
         module = import_module(target_module, directory)
 
-        return module.Listener(config, processor_callback)
+        return module.Listener(config, processor_callback, batch_callback)
     except Exception as e:
         err = '{} is not a supported Listener type: {}'.format(target_module, str(e))
         log.warning(err)
@@ -84,13 +87,26 @@ def detect_metadata_connectors(config):
         raise AttributeError(err)
 
 
+def register_connectors(config):
+    log.info('Registering data- and metadata store connectors')
+    detect_data_connectors(config.data_store)
+
+    if config.meta_store:
+        detect_metadata_connectors(config.meta_store)
+
+
 def import_module(target_module, directory):
+    module = REGISTRY.get((directory, target_module))
+    if module:
+        return module
+
     module_dict = detect_modules(directory)
 
     log.debug('Found {} available modules'.format(len(module_dict)))
     log.debug(module_dict)
 
     module = importlib.import_module(module_dict.get(target_module))
+    REGISTRY[(directory, target_module)] = module
 
     return module
 
@@ -8,8 +8,8 @@ APPLICATION_OCTET_STREAM = 'application/octet-stream'
 log = logging.getLogger(__name__)
 
 
-def get_mime_type(data_path, metadata, config):
-    return mime_from_metadata(metadata, config) or guess_mime_type(data_path) or APPLICATION_OCTET_STREAM
+def get_mime_type(data_path, metadata, config, header=None):
+    return mime_from_metadata(metadata, config) or guess_mime_type(data_path, header) or APPLICATION_OCTET_STREAM
 
 
 def mime_from_metadata(metadata, config):
@@ -27,10 +27,11 @@ def mime_from_metadata(metadata, config):
     return val or None
 
 
-def guess_mime_type(file_path):
+def guess_mime_type(file_path, header=None):
     log.info('Guessing mime type')
 
-    guessed_type = filetype.guess(file_path)
+    # The header is the leading bytes of the file, avoiding to read the file once more
+    guessed_type = filetype.guess(header or file_path)
     if guessed_type:
         return guessed_type.mime
 
@@ -39,14 +40,25 @@ def guess_mime_type(file_path):
         return guessed_type[0]
 
 
+def mime_from_extension(file_path):
+    return mimetypes.guess_type(file_path)[0]
+
+
+def mime_from_header(header):
+    guessed_type = filetype.guess(header) if header else None
+
+    return guessed_type.mime if guessed_type else None
+
+
+def accepts_all(accepted_types):
+    return not accepted_types or '*' in accepted_types
+
+
 def validate_mime_type(mime, accepted_types):
     log.debug('Validating mime type')
     log.debug('Accepted mime types: {}'.format(accepted_types))
 
-    if accepted_types and (
-            mime not in accepted_types
-            and '*' not in accepted_types
-    ):
+    if not accepts_all(accepted_types) and mime not in accepted_types:
         err = 'Mime type "{}" is not supported by any of the active sqAPI plugins'.format(mime)
         log.debug(err)
         raise NotImplementedError(err)
@@ -5,6 +5,7 @@ import sys
 import logging
 import re
 import signal
+import threading
 import yaml
 from contextlib import contextmanager
 
@@ -13,7 +14,8 @@ CONFIG = dict()
 log = logging.getLogger(__name__)
 
 received_signal = False
-in_progress = False
+in_progress = 0
+progress_lock = threading.Lock()
 
 
 class Config:
@@ -31,6 +33,7 @@ class Config:
         self.api = cfg.get('api') or {}
         self.custom = cfg.get('custom') or {}
         self.packages = cfg.get('packages') or {}
+        self.dedup = cfg.get('dedup') or {}
 
     def merge_config(self, override):
         self.plugin.update(override.plugin)
@@ -44,6 +47,7 @@ class Config:
         self.api.update(override.api)
         self.custom.update(override.custom)
         self.packages.update(override.packages)
+        self.dedup.update(override.dedup)
 
 
 def load_config(config_file):
@@ -95,13 +99,16 @@ def signal_blocker():
         sys.exit()
 
     try:
-        in_progress = True
+        with progress_lock:
+            in_progress += 1
         yield
 
     finally:
-        in_progress = False
+        with progress_lock:
+            in_progress -= 1
+            remaining = in_progress
 
-        if received_signal:
+        if received_signal and not remaining:
             log.info('Completed current processes; sqAPI is shutting down')
             sys.exit()
 
@@ -120,5 +127,5 @@ class Timeout:
             signal.signal(signal.SIGALRM, self.handle_timeout)
             signal.alarm(self.seconds)
 
-    def exit(self, exc_type, exc_val, exc_tb):
+    def __exit__(self, exc_type, exc_val, exc_tb):
         signal.alarm(0)
@@ -1,21 +1,103 @@
 #! /usr/bin/env python
+import collections
+import functools
 import logging
+import threading
 import time
 
-from kafka import KafkaConsumer
+from kafka import ConsumerRebalanceListener, KafkaConsumer, TopicPartition
+from kafka.errors import KafkaError
+from kafka.structs import OffsetAndMetadata
+
+from sqapi.messaging.dispatcher import Dispatcher
+
+DEFAULT_MAX_POLL_RECORDS = 500
+DEFAULT_MAX_RETRIES = 5
+IDLE_POLL_TIMEOUT = 1000
+PROGRESS_INTERVAL = 0.1
 
 log = logging.getLogger(__name__)
 
 
+class PartitionLane:
+    """
+    Records of a single partition, processed in offset order.
+    Offsets are committable up to the first record that has not yet completed.
+
+    A record to retry keeps its place among the records in flight, so later records cannot commit past it,
+    and holds back the rest of the partition until it has completed, or has used up its retries.
+    """
+
+    def __init__(self, partition: TopicPartition):
+        self.partition = partition
+        self.queued = collections.deque()
+        self.in_flight = collections.OrderedDict()
+        self.committable = None
+        self.committed = None
+        self.retry_at = None
+        self.retrying = None
+        self.retries = 0
+
+    def ready(self, limit: int, now: float) -> bool:
+        if self.retry_at and self.retry_at > now:
+            return False
+
+        if self.retrying is not None:
+            return bool(self.queued) and self.queued[0].offset == self.retrying
+
+        return bool(self.queued) and len(self.in_flight) < limit
+
+    def take(self):
+        self.retry_at = None
+        record = self.queued.popleft()
+
+        # A retried record is already in flight, and keeps its original position
+        self.in_flight[record.offset] = None
+
+        return record
+
+    def completed(self, record):
+        self.in_flight[record.offset] = record
+        if record.offset == self.retrying:
+            self.retrying = None
+            self.retries = 0
+
+        # Only a contiguous run of completed records from the oldest one moves the offset forward
+        while self.in_flight:
+            offset, done = next(iter(self.in_flight.items()))
+            if not done:
+                break
+
+            self.in_flight.popitem(last=False)
+            self.committable = offset + 1
+
+    def retry(self, record, interval: float):
+        self.queued.appendleft(record)
+        self.retry_at = time.monotonic() + interval
+        self.retrying = record.offset
+        self.retries += 1
+
+    def pending_commit(self):
+        if self.committable is None or self.committable == self.committed:
+            return None
+
+        return self.committable
+
+    @property
+    def backlog(self):
+        return len(self.queued) + len(self.in_flight) - (1 if self.retrying in self.in_flight else 0)
+
+
 class Listener:
 
-    def __init__(self, config: dict, process_message):
+    def __init__(self, config: dict, process_message, process_batch=None):
         self.config = config if config else dict()
         self.pm_callback = process_message
+        self.dispatcher = Dispatcher(self.config, process_message, batch_callback=process_batch)
         log.info('Loading Kafka')
 
         self.retry_interval = float(config.get('retry_interval', 3))
-        self.delay = config.get('process_delay', 0)
+        self.max_retries = int(config.get('max_retries', DEFAULT_MAX_RETRIES))
 
         self.host = config.get('host', 'localhost')
         self.port = config.get('port', 9092)
@@ -24,36 +106,196 @@ class Listener:
         self.sub_pattern = config.get('subscription_pattern', None)
         self.consumer_group = config.get('consumer_group', 'sqapi')
         self.api_version = tuple(config.get('api_version', [0, 10, 0]))
+        self.max_poll_records = int(config.get('max_poll_records', DEFAULT_MAX_POLL_RECORDS))
+
+        # Records of a partition are processed one at a time, or a batch at a time when batching
+        self.partition_limit = self.dispatcher.batch_size if self.dispatcher.batch_callback else 1
+
+        self.lanes = dict()
+        self.lock = threading.Lock()
+        self.progress = threading.Event()
 
     def start_listener(self):
-        while True:
+        while not self.dispatcher.shutting_down:
             log.info(f'Listening for messages from Kafka')
             consumer = KafkaConsumer(
                 group_id=self.consumer_group,
                 api_version=self.api_version,
-                bootstrap_servers=f'{self.host}:{self.port}'
+                bootstrap_servers=f'{self.host}:{self.port}',
+                enable_auto_commit=False,
+                max_poll_records=self.max_poll_records
             )
 
             log.info(f'Subscription topics: {self.topic_names}')
             log.info(f'Subscription pattern: {self.sub_pattern}')
-            consumer.subscribe(topics=self.topic_names, pattern=self.sub_pattern)
+            consumer.subscribe(
+                topics=self.topic_names, pattern=self.sub_pattern,
+                listener=PartitionRebalanceListener(self, consumer)
+            )
+
+            try:
+                self.consume(consumer)
+
+            finally:
+                self.commit_offsets(consumer)
+                consumer.close(autocommit=False)
+
+        log.info('Kafka listener stopped, due to shutdown')
+
+    def consume(self, consumer):
+        while not self.dispatcher.shutting_down:
+            self.progress.clear()
+
+            idle = self.idle()
+            records = consumer.poll(timeout_ms=IDLE_POLL_TIMEOUT if idle else 0, max_records=self.max_poll_records)
+
+            for partition, partition_records in records.items():
+                self.enqueue(partition, partition_records)
+
+            self.pause_busy_partitions(consumer)
+            self.dispatch_ready()
+            self.commit_offsets(consumer)
 
-            consumer.poll()
-            for msg in consumer:
+            if not records and not idle:
+                self.progress.wait(PROGRESS_INTERVAL)
+
+    def idle(self):
+        with self.lock:
+            return not any(lane.backlog for lane in self.lanes.values())
+
+    def enqueue(self, partition, records):
+        with self.lock:
+            lane = self.lanes.get(partition)
+            if not lane:
+                lane = self.lanes[partition] = PartitionLane(partition)
+
+            for msg in records:
                 log.info('Received message: {} (topic), {} (partition), {} (offset), {} (key)'.format(
                     msg.topic, msg.partition, msg.offset, msg.key
                 ))
-                self.parse_message(msg)
+                lane.queued.append(msg)
+
+    def pause_busy_partitions(self, consumer):
+        with self.lock:
+            busy = [p for p, lane in self.lanes.items() if lane.backlog >= self.max_poll_records]
+            caught_up = [p for p, lane in self.lanes.items() if lane.backlog < self.max_poll_records]
+
+        paused = consumer.paused()
+        to_pause = [p for p in busy if p not in paused]
+        to_resume = [p for p in caught_up if p in paused]
+
+        if to_pause:
+            log.debug('Pausing partitions until processing has caught up: {}'.format(to_pause))
+            consumer.pause(*to_pause)
+        if to_resume:
+            log.debug('Resuming partitions: {}'.format(to_resume))
+            consumer.resume(*to_resume)
+
+    def dispatch_ready(self):
+        while True:
+            now = time.monotonic()
+            with self.lock:
+                # Dispatching stops when the window is full, letting the poll loop commit and heartbeat meanwhile
+                in_flight = sum(len(lane.in_flight) for lane in self.lanes.values())
+                ready = [lane for lane in self.lanes.values() if lane.ready(self.partition_limit, now)]
+                if not ready or in_flight >= self.dispatcher.capacity:
+                    return
 
-    def parse_message(self, body):
-        log.info('Processing starts after delay ({} seconds)'.format(self.delay))
-        time.sleep(self.delay)
+                # One record from each ready partition at a time, sharing the window between the partitions
+                dispatching = [(lane, lane.take()) for lane in ready[:self.dispatcher.capacity - in_flight]]
 
+            for lane, record in dispatching:
+                self.parse_message(record, lane)
+
+    def parse_message(self, body, lane):
+        log.debug('Message body: {}'.format(body))
+        self.dispatcher.submit(
+            body.value, on_done=functools.partial(self.handle_result, record=body, lane=lane), received=received(body)
+        )
+
+    def handle_result(self, future, record, lane):
         try:
-            log.debug('Message body: {}'.format(body))
+            future.result()
 
-            self.pm_callback(body.value.decode('utf-8'))
+        except LookupError as e:
+            with self.lock:
+                exhausted = lane.retries >= self.max_retries
+                if not exhausted:
+                    lane.retry(record, self.retry_interval)
+
+            if not exhausted:
+                log.warning('Could not process received message, retrying in {} seconds: {}'.format(
+                    self.retry_interval, str(e)
+                ))
+                self.progress.set()
+                return
+
+            # The partition moves on, rather than being held back by a record that may never be processable
+            log.warning('Could not process received message after {} retries: {}'.format(self.max_retries, str(e)))
 
         except Exception as e:
             err = 'Could not process received message: {}'.format(str(e))
             log.warning(err)
+
+        except SystemExit:
+            log.warning('Could not process received message, due to shutdown')
+            self.progress.set()
+            return
+
+        with self.lock:
+            lane.completed(record)
+        self.progress.set()
+
+    def commit_offsets(self, consumer):
+        with self.lock:
+            offsets = {p: lane.pending_commit() for p, lane in self.lanes.items()}
+            offsets = {p: OffsetAndMetadata(offset, None) for p, offset in offsets.items() if offset is not None}
+
+        if not offsets:
+            return
+
+        log.debug('Committing offsets: {}'.format(offsets))
+        try:
+            consumer.commit(offsets)
+
+        except KafkaError as e:
+            log.warning('Could not commit offsets, records may be processed again: {}'.format(str(e)))
+            return
+
+        with self.lock:
+            for partition, offset in offsets.items():
+                lane = self.lanes.get(partition)
+                if lane:
+                    lane.committed = offset.offset
+
+    def revoke(self, consumer, partitions):
+        self.commit_offsets(consumer)
+
+        with self.lock:
+            for partition in partitions:
+                # Records still in flight complete on the detached lane, and are read again by the new owner
+                self.lanes.pop(partition, None)
+
+
+def received(record):
+    """
+    Monotonic time of when the record was produced, so the processing delay is not applied again
+    to records that already waited in the partition, nor to each record of a partition in turn
+    """
+    if not record.timestamp or record.timestamp < 0:
+        return None
+
+    return time.monotonic() - max(time.time() - record.timestamp / 1000.0, 0)
+
+
+class PartitionRebalanceListener(ConsumerRebalanceListener):
+    def __init__(self, listener: Listener, consumer):
+        self.listener = listener
+        self.consumer = consumer
+
+    def on_partitions_revoked(self, revoked):
+        log.info('Partitions revoked: {}'.format(revoked))
+        self.listener.revoke(self.consumer, revoked)
+
+    def on_partitions_assigned(self, assigned):
+        log.info('Partitions assigned: {}'.format(assigned))
@@ -1,13 +1,17 @@
 #! /usr/bin/env python
 import time
 
+import copy
 import datetime
 import functools
 import logging
-import pika
+import queue
 import threading
+
+import pika
 from contextlib import suppress
 from pika.exceptions import StreamLostError, ChannelClosed, AMQPConnectionError, ConnectionWrongStateError
+from sqapi.messaging.dispatcher import Dispatcher
 from sqapi.processing.exception import SqapiPluginExecutionError, PluginFailure
 
 log = logging.getLogger(__name__)
@@ -15,13 +19,13 @@ log = logging.getLogger(__name__)
 
 class Listener:
 
-    def __init__(self, config: dict, process_message):
+    def __init__(self, config: dict, process_message, process_batch=None):
         self.config = config if config else dict()
         self.pm_callback = process_message
+        self.dispatcher = Dispatcher(self.config, process_message, batch_callback=process_batch)
         log.info('Loading RabbitMQ')
 
         self.retry_interval = float(config.get('retry_interval', 3))
-        self.delay = config.get('process_delay', 0)
 
         self.routing_keys = config.get('routing_keys', [])
         routing_key = config.get('routing_key')
@@ -32,6 +36,9 @@ class Listener:
         self.exchange_type = config.get('exchange_type', 'fanout')
         self.requeue_failures = config.get('requeue', True)
 
+        # Deliveries beyond what the dispatcher is able to process are left in the broker
+        self.prefetch_count = int(config.get('prefetch_count', self.dispatcher.capacity))
+
         dlq_config = config.get('dlq', {})
         self.dlq_exchange = dlq_config.get('exchange', 'DLQ')
         self.dlq_exchange_type = dlq_config.get('exchange_type', 'topic')
@@ -40,6 +47,10 @@ class Listener:
         self.host = config.get('host', 'localhost')
         self.port = config.get('port', 5672)
 
+        self.dlq_publisher = DeadLetterPublisher(
+            self.host, self.port, self.dlq_exchange, self.dlq_exchange_type, dlq_config, self.retry_interval
+        )
+
         self.test_connection()
 
     def test_connection(self):
@@ -62,11 +73,17 @@ class Listener:
                 time.sleep(self.retry_interval)
 
     def start_listener(self):
+        self.dlq_publisher.start()
+
         while True:
             try:
                 listener = self.listen_exchange if self.config.get('exchange_name') else self.listen_queue
                 listener()
 
+                if self.dispatcher.shutting_down:
+                    log.error('System is shutting down - exiting RabbitMQ consumer')
+                    break
+
             except (StreamLostError, ChannelClosed, AMQPConnectionError) as e:
                 log.warning('Lost connection to broker: {}'.format(str(e)))
 
@@ -84,10 +101,11 @@ class Listener:
             finally:
                 time.sleep(1)
 
+        self.dlq_publisher.close()
         log.info('Finished consuming from RabbitMQ')
 
     def listen_queue(self):
-        log.info('Starting Queue listener with routing key: {}'.format(self.routing_key))
+        log.info('Starting Queue listener with routing keys: {}'.format(self.routing_keys))
         connection, channel = self._create_connection()
 
         # Create a queue
@@ -97,7 +115,7 @@ class Listener:
                 'x-max-priority': 3
             })
         queue_name = res.method.queue
-        callback = functools.partial(self.message_receiver, connection=connection)
+        callback = functools.partial(self.message_receiver, connection=connection, acknowledger=Acknowledger(channel))
         channel.basic_consume(queue=queue_name, on_message_callback=callback)
 
         log.debug('Starting to consume from queue: {}'.format(queue_name))
@@ -118,7 +136,7 @@ class Listener:
         queue_name = res.method.queue
         for key in self.routing_keys:
             channel.queue_bind(exchange=self.exchange_name, queue=queue_name, routing_key=key)
-        callback = functools.partial(self.message_receiver, connection=connection)
+        callback = functools.partial(self.message_receiver, connection=connection, acknowledger=Acknowledger(channel))
         channel.basic_consume(queue=queue_name, on_message_callback=callback)
 
         log.debug('Starting to consume from exchange: {}'.format(self.exchange_name))
@@ -128,93 +146,231 @@ class Listener:
         connection = pika.BlockingConnection(pika.ConnectionParameters(self.host, self.port))
         channel = connection.channel()
 
-        return channel
+        if self.prefetch_count:
+            log.debug('Limiting unacknowledged deliveries to {}'.format(self.prefetch_count))
+            channel.basic_qos(prefetch_count=self.prefetch_count)
+
+        return connection, channel
 
     def publish_to_dlq(self, method, properties, body, e: SqapiPluginExecutionError):
-        try:
-            connection, channel = self._create_connection()
-            channel.exchange_declare(exchange=self.dlq_exchange, exchange_type=self.dlq_exchange_type, durable=True)
-
-            for error in e.failures:
-                properties.headers = {
-                    'x-death': {
-                        'x-exception-information': {
-                            'x-exception-timestamp': str(datetime.datetime.utcnow().isoformat()),
-                            'x-exception-reason': str(error.reason),
-                            'x-exception-system': 'Sqapi',
-                            'x-exception-type': str(error.exception_type),
-                        },
-                        'queue': '.'.join([x for x in [self.queue_name, error.plugin] if x]),
-                        'exchange': method.exchange,
-                        'routing-keys': [method.routing_key],
-                    }
+        for error in e.failures:
+            # Published later by the DLQ publisher, so each failure gets its own properties
+            dlq_properties = copy.copy(properties)
+            dlq_properties.headers = {
+                'x-death': {
+                    'x-exception-information': {
+                        'x-exception-timestamp': str(datetime.datetime.utcnow().isoformat()),
+                        'x-exception-reason': str(error.reason),
+                        'x-exception-system': 'Sqapi',
+                        'x-exception-type': str(error.exception_type),
+                    },
+                    'queue': '.'.join([x for x in [self.queue_name, error.plugin] if x]),
+                    'exchange': method.exchange,
+                    'routing-keys': [method.routing_key],
                 }
-                log.debug(f'Headers: {properties.headers}')
+            }
+            log.debug(f'Headers: {dlq_properties.headers}')
 
-                channel.basic_publish(exchange=self.dlq_exchange,
-                                      routing_key='.'.join([
-                                          self.dlq_routing_key, error.plugin
-                                      ]),
-                                      properties=properties,
-                                      body=body)
+            self.dlq_publisher.publish('.'.join([self.dlq_routing_key, error.plugin]), dlq_properties, body)
 
-        except Exception as e:
-            log.error(f'Failed publishing message to DLQ: {str(e)}')
-
-    def message_receiver(self, ch, method, properties, body, connection):
+    def message_receiver(self, ch, method, properties, body, connection, acknowledger):
         log.info('Received message')
         log.debug(f'Channel: {ch}, Method: {method}, Properties: {properties}, Message: {body}')
 
-        t = threading.Thread(target=self.handle_message, args=(connection, ch, method, properties, body))
-        t.start()
+        rk_parts = method.routing_key.split('.')
+        specific_plugin = rk_parts[2] if len(rk_parts) == 3 else None
 
-    def handle_message(self, connection, ch, method, properties, body):
-        cb = None
+        acknowledger.received(method.delivery_tag)
+        self.dispatcher.submit(body, specific_plugin, on_done=functools.partial(
+            self.handle_result, connection=connection, acknowledger=acknowledger,
+            ch=ch, method=method, properties=properties, body=body
+        ))
 
+    def handle_result(self, future, connection, acknowledger, ch, method, properties, body):
         try:
-            rk_parts = method.routing_key.split('.')
-            specific_plugin = rk_parts[2] if len(rk_parts) is 3 else None
-
-            self.pm_callback(body, specific_plugin)
-            cb = functools.partial(self.send_ack, ch=ch, tag=method.delivery_tag)
+            future.result()
+            acknowledger.completed(method.delivery_tag)
 
         except SqapiPluginExecutionError as e:
-            log.warning('Registering {len(e.failures)} errors from plugin execution')
-            cb = functools.partial(self.send_nack, ch=ch, tag=method.delivery_tag)
+            log.warning(f'Registering {len(e.failures)} errors from plugin execution')
+            acknowledger.completed(method.delivery_tag, ack=False)
             self.publish_to_dlq(method, properties, body, e)
 
         except Exception as e:
             log.warning(f'Could not process received message: {str(e)}')
-            cb = functools.partial(self.send_nack, ch=ch, tag=method.delivery_tag, rq=self.requeue_failures)
+            acknowledger.completed(method.delivery_tag, ack=False, requeue=self.requeue_failures)
             self.publish_to_dlq(method, properties, body, SqapiPluginExecutionError([PluginFailure('', e)]))
 
-        except SystemExit as e:
+        except SystemExit:
             log.warning('Could not process received message, due to shutdown')
             with suppress(ConnectionWrongStateError, StreamLostError):
-                ch.stop_consuming()
-                ch.close()
-                connection.close()
+                connection.add_callback_threadsafe(ch.stop_consuming)
+            return
+
+        connection.add_callback_threadsafe(acknowledger.send)
 
-            raise e
 
-        finally:
-            if cb:
-                connection.add_callback_threadsafe(cb)
+class Acknowledger:
+    """
+    Acknowledges the deliveries of a channel as they complete.
+    Consecutive successful deliveries, following the last settled delivery, are acknowledged at once
+    using a single multi-ack, while deliveries completing ahead of earlier ones are acknowledged by themselves,
+    so a slow delivery does not hold back the prefetch window.
+
+    Results may be registered from any thread, while `send` must be called from the connection thread.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.outstanding = dict()
+        self.results = dict()
+        self.lock = threading.Lock()
+
+    def received(self, tag):
+        with self.lock:
+            self.outstanding[tag] = None
+
+    def completed(self, tag, ack=True, requeue=False):
+        with self.lock:
+            self.results[tag] = (ack, requeue)
+
+    def send(self):
+        with self.lock:
+            last_ack = None
+
+            while self.outstanding and next(iter(self.outstanding)) in self.results:
+                tag = next(iter(self.outstanding))
+                del self.outstanding[tag]
+                ack, requeue = self.results.pop(tag)
+
+                if ack:
+                    last_ack = tag
+                    continue
+
+                if last_ack:
+                    self._send_ack(last_ack, multiple=True)
+                    last_ack = None
+
+                self._send_nack(tag, requeue)
+
+            if last_ack:
+                self._send_ack(last_ack, multiple=True)
+
+            # Completed ahead of an earlier delivery still in flight
+            for tag, (ack, requeue) in self.results.items():
+                self.outstanding.pop(tag, None)
+
+                if ack:
+                    self._send_ack(tag, multiple=False)
+                else:
+                    self._send_nack(tag, requeue)
 
-    def send_ack(self, ch, tag):
+            self.results.clear()
+
+    def _send_ack(self, tag, multiple):
         try:
-            ch.basic_ack(delivery_tag=tag)
-            log.info('Message acknowledged sent')
+            self.channel.basic_ack(delivery_tag=tag, multiple=multiple)
+            log.info('Message acknowledged sent, {} delivery {}'.format('up to' if multiple else 'for', tag))
         except Exception as e:
             err = f'Failed sending ack'
             log.warning(err)
             raise ConnectionError(err, e)
 
-    def send_nack(self, ch, tag, rq=False):
+    def _send_nack(self, tag, requeue):
         try:
-            ch.basic_nack(delivery_tag=tag, requeue=rq)
+            self.channel.basic_nack(delivery_tag=tag, requeue=requeue)
             log.info('Message acknowledged sent')
         except Exception as e:
             err = f'Failed sending nack'
             log.warning(err)
             raise ConnectionError(err, e)
+
+
+class DeadLetterPublisher:
+    """
+    Publishes failed messages to the DLQ exchange over a single long-lived connection.
+    Messages are buffered in memory and published in transactions of up to `batch_size` messages,
+    so a batch is only removed from the buffer when the broker has accepted it.
+    While the broker is unavailable, the buffer holds up to `buffer_size` messages.
+    """
+
+    def __init__(self, host, port, exchange, exchange_type, config: dict, retry_interval: float = 3):
+        self.host = host
+        self.port = port
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+        self.retry_interval = retry_interval
+
+        self.batch_size = int(config.get('batch_size', 100))
+        self.buffer = queue.Queue(maxsize=int(config.get('buffer_size', 10000)))
+        self.pending = []
+
+        self.closing = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread:
+            return
+
+        self.thread = threading.Thread(name='DLQ Publisher', target=self._run, daemon=True)
+        self.thread.start()
+
+    def publish(self, routing_key, properties, body):
+        try:
+            self.buffer.put_nowait((routing_key, properties, body))
+
+        except queue.Full:
+            log.error('DLQ buffer is full, dropping failed message for {}'.format(routing_key))
+
+    def close(self, timeout=10):
+        log.debug('Closing DLQ publisher, after publishing buffered messages')
+        self.closing.set()
+
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+    def _run(self):
+        while not (self.closing.is_set() and self.buffer.empty() and not self.pending):
+            connection = None
+            try:
+                connection = pika.BlockingConnection(pika.ConnectionParameters(self.host, self.port))
+                channel = connection.channel()
+                channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type, durable=True)
+                channel.tx_select()
+                log.debug('DLQ publisher connected to RabbitMQ')
+
+                self._publish_buffered(connection, channel)
+
+            except Exception as e:
+                log.warning('DLQ publisher lost connection, {} messages buffered: {}'.format(
+                    len(self.pending) + self.buffer.qsize(), str(e)
+                ))
+                time.sleep(self.retry_interval)
+
+            finally:
+                if connection and connection.is_open:
+                    with suppress(Exception):
+                        connection.close()
+
+    def _publish_buffered(self, connection, channel):
+        while not (self.closing.is_set() and self.buffer.empty() and not self.pending):
+            if not self.pending:
+                try:
+                    self.pending.append(self.buffer.get(timeout=1))
+                except queue.Empty:
+                    # Keeps the connection alive, by responding to heartbeats
+                    connection.process_data_events(time_limit=0)
+                    continue
+
+            while len(self.pending) < self.batch_size:
+                try:
+                    self.pending.append(self.buffer.get_nowait())
+                except queue.Empty:
+                    break
+
+            for routing_key, properties, body in self.pending:
+                channel.basic_publish(exchange=self.exchange, routing_key=routing_key, properties=properties, body=body)
+            channel.tx_commit()
+
+            log.info('Published {} failed messages to DLQ'.format(len(self.pending)))
+            self.pending = []
@@ -1,23 +1,30 @@
 #! /usr/bin/env python
 import logging
-import time
+import threading
 
 import zmq as zmq
 
+from sqapi.messaging.dispatcher import Dispatcher
+
+WORKER_ADDRESS = 'inproc://sqapi-workers'
+POLL_TIMEOUT = 1000
+ACK = b'ACK'
+NACK = b'NACK'
+
 log = logging.getLogger(__name__)
 
 
 class Listener:
 
-    def __init__(self, config: dict, process_message):
+    def __init__(self, config: dict, process_message, process_batch=None):
         self.config = config if config else dict()
         self.pm_callback = process_message
+        self.dispatcher = Dispatcher(self.config, process_message, batch_callback=process_batch)
         log.info('Loading ZeroMQ')
 
         self.context = zmq.Context()
 
         self.retry_interval = float(config.get('retry_interval', 3))
-        self.delay = config.get('process_delay', 0)
 
         self.host = config.get('host', '127.0.0.1')
         self.port = config.get('port', 5001)
@@ -26,11 +33,23 @@ class Listener:
         self.socket_type = config.get('socket_type', zmq.PULL)
         self.protocol = config.get('protocol', 'tcp')
 
+        # Replying requires a worker per outstanding request, as each waits for the result of its message
+        self.reply = config.get('reply', False)
+        self.workers = max(int(config.get('workers', self.dispatcher.max_in_flight if self.reply else 1)), 1)
+        self.rcvhwm = config.get('rcvhwm', None)
+
     def start_listener(self):
         connect_addr = f'{self.protocol}://{self.host}:{self.port}'
-        print(f'Connecting to {self.socket_type}-socket on {connect_addr}')
 
-        socket = self.context.socket(self.socket_type)
+        # Requests are routed through the proxy and back to the requester, by the identity of the requester
+        socket_type = zmq.ROUTER if self.reply else self.socket_type
+        log.info(f'Connecting to {socket_type}-socket on {connect_addr}')
+
+        socket = self.context.socket(socket_type)
+        if self.rcvhwm is not None:
+            log.debug('Holding up to {} received messages'.format(self.rcvhwm))
+            socket.rcvhwm = int(self.rcvhwm)
+
         if self.connection_type.lower() == 'connect':
             socket.connect(connect_addr)
 
@@ -40,23 +59,71 @@ class Listener:
         else:
             raise AttributeError(f'Connection type "{self.connection_type}" is not a supported type')
 
+        if self.reply or self.workers > 1:
+            self._start_workers(socket)
+        else:
+            self._listen_for_messages(socket)
+
+    def _start_workers(self, frontend):
+        log.info('Distributing messages to {} workers'.format(self.workers))
+
+        backend = self.context.socket(zmq.DEALER if self.reply else zmq.PUSH)
+        backend.bind(WORKER_ADDRESS)
+
+        workers = [threading.Thread(
+            name=f'ZeroMQ Worker {i}',
+            target=self._work,
+            daemon=True
+        ) for i in range(self.workers)]
+
+        for worker in workers:
+            worker.start()
+
+        # The proxy forwards the frames between the sockets without copying, until the process exits
+        threading.Thread(name='ZeroMQ Proxy', target=zmq.proxy, args=[frontend, backend], daemon=True).start()
+
+        for worker in workers:
+            worker.join()
+
+    def _work(self):
+        socket = self.context.socket(zmq.REP if self.reply else zmq.PULL)
+        socket.connect(WORKER_ADDRESS)
+
         self._listen_for_messages(socket)
 
     def _listen_for_messages(self, socket):
-        while True:
-            log.info(f'Listening for messages on socket')
-            body = socket.recv()
-            log.info(f'Received message on socket')
-            self.parse_message(body)
+        log.info(f'Listening for messages on socket')
+
+        while not self.dispatcher.shutting_down:
+            if not socket.poll(POLL_TIMEOUT):
+                continue
+
+            frame = socket.recv(copy=False)
+            log.debug(f'Received message on socket')
+
+            try:
+                future = self.parse_message(frame.buffer)
+
+            except SystemExit as e:
+                if self.reply:
+                    socket.send(b' '.join([NACK, str(e).encode('utf-8')]))
+                break
+
+            if self.reply:
+                exception = future.exception()
+                socket.send(ACK if exception is None else b' '.join([NACK, str(exception).encode('utf-8')]))
+
+        log.info('ZeroMQ listener stopped, due to shutdown')
 
     def parse_message(self, body):
-        log.info('Received message. Processing starts after delay ({} seconds)'.format(self.delay))
-        time.sleep(self.delay)
+        log.debug('Received message: {} bytes'.format(len(body)))
 
-        try:
-            log.debug('Received message: {}'.format(body))
+        return self.dispatcher.submit(body, on_done=self.handle_result)
 
-            self.pm_callback(body)
+    @staticmethod
+    def handle_result(future):
+        try:
+            future.result()
 
         except Exception as e:
             err = 'Could not process received message: {}'.format(str(e))
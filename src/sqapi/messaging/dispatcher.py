@@ -0,0 +1,293 @@
+#! /usr/bin/env python3
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+DEFAULT_MAX_IN_FLIGHT = os.cpu_count() or 1
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_BATCH_INTERVAL = 1000
+DEFAULT_MAX_DELAYED = 1000
+
+log = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    """
+    Hands received messages over to the processing callback,
+    with a bounded number of messages in flight at the same time.
+
+    Submitting blocks while the window is full, which stops the listener
+    from fetching more messages until processing has caught up.
+
+    When `batch` is configured and a `batch_callback` is given, messages are accumulated
+    until `size` messages are buffered or the oldest has waited `interval` milliseconds.
+    The batch callback receives the arguments of each message as a list of tuples,
+    and returns a list with the result (or exception) of each message.
+
+    Coroutine callbacks are run on an event loop owned by the dispatcher,
+    where blocking stages are expected to be handed over to the default executor of the loop.
+
+    When `process_delay` is configured, messages are held in a timer queue until they are due,
+    while the listener keeps receiving. Submitting blocks when `max_delayed` messages are waiting.
+    """
+
+    def __init__(self, config: dict, callback, batch_callback=None):
+        self.callback = callback
+        self.max_in_flight = max(int(config.get('max_in_flight', DEFAULT_MAX_IN_FLIGHT)), 1)
+
+        batch_config = config.get('batch') or {}
+        self.batch_callback = batch_callback if batch_config else None
+        self.batch_size = max(int(batch_config.get('size', DEFAULT_BATCH_SIZE)), 1)
+        self.batch_interval = batch_config.get('interval', DEFAULT_BATCH_INTERVAL) / 1000.0
+        self.batch = []
+        self.batch_started = None
+        self.batch_lock = threading.Condition()
+        self.flush_lock = threading.Lock()
+
+        self.delay = float(config.get('process_delay') or 0)
+        self.max_delayed = max(int(config.get('max_delayed', DEFAULT_MAX_DELAYED)), 1)
+        self.scheduled = []
+        self.sequence = itertools.count()
+        self.schedule_lock = threading.Condition()
+        self.delayed = threading.BoundedSemaphore(self.max_delayed)
+
+        self.window = threading.BoundedSemaphore(self.max_in_flight)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='Dispatcher')
+
+        self.shutting_down = False
+
+        self.loop = None
+        if asyncio.iscoroutinefunction(callback):
+            self.loop = self._start_event_loop()
+
+        if self.batch_callback:
+            log.info('Dispatching messages in batches of up to {}'.format(self.batch_size))
+            threading.Thread(name='Dispatcher Batch Flusher', target=self._flush_periodically, daemon=True).start()
+
+        if self.delay:
+            log.info('Processing starts after delay ({} seconds)'.format(self.delay))
+            threading.Thread(name='Dispatcher Scheduler', target=self._run_scheduler, daemon=True).start()
+
+    @property
+    def capacity(self):
+        """
+        Number of messages the dispatcher is able to hold, either processing, delayed or waiting for a batch
+        """
+        capacity = self.max_in_flight * (self.batch_size if self.batch_callback else 1)
+
+        return capacity + (self.max_delayed if self.delay else 0)
+
+    def submit(self, body, *args, on_done=None, received=None):
+        """
+        Dispatches the message for processing, after the configured delay
+
+        :param body: Message body, passed on to the callback with the remaining arguments
+        :param on_done: Called with the future of the message, once processed
+        :param received: Monotonic time the delay is counted from, defaults to now
+        :return: Future resulting in the outcome of the callback
+        """
+        if self.shutting_down:
+            raise SystemExit('Dispatcher is shutting down')
+
+        if self.delay:
+            due = (received if received is not None else time.monotonic()) + self.delay
+            if due > time.monotonic():
+                return self._schedule(due, body, args, on_done)
+
+        return self._dispatch(body, args, on_done)
+
+    def _dispatch(self, body, args, on_done):
+        if self.batch_callback:
+            return self._add_to_batch(body, args, on_done)
+
+        return self._submit(self.callback, body, *args, on_done=on_done)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.batch_lock:
+                items, self.batch = self.batch, []
+                self.batch_started = None
+
+            if not items:
+                return
+
+            log.debug('Dispatching batch of {} messages'.format(len(items)))
+            try:
+                self._submit(
+                    self.batch_callback, [(body, *args) for body, args, _, _ in items],
+                    on_done=lambda f: self._batch_completed(f, items)
+                )
+
+            except BaseException as e:
+                failed = Future()
+                failed.set_exception(e)
+                self._batch_completed(failed, items)
+                raise
+
+    def _schedule(self, due, body, args, on_done):
+        self.delayed.acquire()
+
+        future = Future()
+        with self.schedule_lock:
+            heapq.heappush(self.scheduled, (due, next(self.sequence), body, args, on_done, future))
+            self.schedule_lock.notify()
+
+        return future
+
+    def _run_scheduler(self):
+        while True:
+            with self.schedule_lock:
+                while not self.scheduled:
+                    self.schedule_lock.wait()
+
+                remaining = self.scheduled[0][0] - time.monotonic()
+                if remaining > 0:
+                    self.schedule_lock.wait(remaining)
+                    continue
+
+                _, _, body, args, on_done, future = heapq.heappop(self.scheduled)
+
+            try:
+                if self.shutting_down:
+                    raise SystemExit('Dispatcher is shutting down')
+
+                _chain(self._dispatch(body, args, on_done), future)
+
+            except BaseException as e:
+                future.set_exception(e)
+                self._acknowledge_delayed(future, on_done)
+
+            finally:
+                self.delayed.release()
+
+    @staticmethod
+    def _acknowledge_delayed(future, on_done):
+        try:
+            if on_done:
+                on_done(future)
+
+        except Exception as e:
+            log.warning('Failed completing delayed message: {}'.format(str(e)))
+
+    def _add_to_batch(self, body, args, on_done):
+        future = Future()
+
+        with self.batch_lock:
+            self.batch.append((body, args, on_done, future))
+            if not self.batch_started:
+                self.batch_started = time.monotonic()
+                self.batch_lock.notify()
+
+            full = len(self.batch) >= self.batch_size
+
+        if full:
+            self.flush()
+
+        return future
+
+    def _flush_periodically(self):
+        while True:
+            with self.batch_lock:
+                while not self.batch_started:
+                    self.batch_lock.wait()
+
+                remaining = self.batch_started + self.batch_interval - time.monotonic()
+
+            if remaining > 0:
+                time.sleep(remaining)
+                continue
+
+            try:
+                self.flush()
+            except SystemExit:
+                log.debug('Dispatcher is shutting down, batch flusher stopped')
+                return
+
+    def _batch_completed(self, future, items):
+        exception = future.exception()
+        results = future.result() if not exception else [exception] * len(items)
+
+        for (_, _, on_done, item_future), result in zip(items, results):
+            if isinstance(result, BaseException):
+                item_future.set_exception(result)
+            else:
+                item_future.set_result(result)
+
+            try:
+                if on_done:
+                    on_done(item_future)
+
+            except Exception as e:
+                log.warning('Failed completing processed message: {}'.format(str(e)))
+
+    def _submit(self, callback, *args, on_done=None):
+        if self.shutting_down:
+            raise SystemExit('Dispatcher is shutting down')
+
+        self.window.acquire()
+        log.debug('Dispatching message ({} in flight at most)'.format(self.max_in_flight))
+
+        try:
+            if self.loop and asyncio.iscoroutinefunction(callback):
+                future = Future()
+                asyncio.run_coroutine_threadsafe(self._run_coroutine(future, callback, *args), self.loop)
+            else:
+                future = self.executor.submit(callback, *args)
+        except Exception:
+            self.window.release()
+            raise
+
+        future.add_done_callback(lambda f: self._completed(f, on_done))
+
+        return future
+
+    def _start_event_loop(self):
+        loop = asyncio.new_event_loop()
+
+        # Both the content and metadata of each message may be fetched at the same time
+        loop.set_default_executor(ThreadPoolExecutor(
+            max_workers=self.max_in_flight * 2, thread_name_prefix='Dispatcher IO'
+        ))
+
+        log.info('Dispatching messages to coroutines, with {} in flight at most'.format(self.max_in_flight))
+        threading.Thread(name='Dispatcher Event Loop', target=loop.run_forever, daemon=True).start()
+
+        return loop
+
+    @staticmethod
+    async def _run_coroutine(future, callback, *args):
+        # SystemExit would stop the event loop if raised out of the coroutine, so it is passed on to the future
+        try:
+            future.set_result(await callback(*args))
+
+        except BaseException as e:
+            future.set_exception(e)
+
+    def _completed(self, future, on_done):
+        if isinstance(future.exception(), SystemExit):
+            self.shutting_down = True
+
+        try:
+            if on_done:
+                on_done(future)
+
+        except Exception as e:
+            log.warning('Failed completing processed message: {}'.format(str(e)))
+
+        finally:
+            self.window.release()
+
+
+def _chain(source: Future, destination: Future):
+    def copy(f):
+        if f.exception() is not None:
+            destination.set_exception(f.exception())
+        else:
+            destination.set_result(f.result())
+
+    source.add_done_callback(copy)
@@ -9,27 +9,61 @@ MSG_FIELDS = {
 }
 
 
-class Message:
+# Message attributes, with the name of the field defining its key in the message body
+ATTRIBUTE_FIELDS = {
+    'uuid': 'uuid',
+    'type': 'type',
+    'metadata': 'metadata',
+    'data_location': 'data_location',
+    'meta_location': 'meta_location',
+}
 
-    def __init__(self, body: dict, config: dict):
-        self.body = body
 
-        self.msg_fields = config.get('fields', MSG_FIELDS)
-        self.msg_fields.get('data_location').update({'required': True})  # Enforce requirement of data location
+class MessageSchema:
+    """
+    The message configuration compiled once, resolving the keys and required fields
+    used for every message parsed afterwards
+    """
 
-        self.hash_digest = None
+    def __init__(self, config: dict):
+        self.config = config
+        self.parser = config.get('parser', {})
+        self.parser_type = self.parser.get('type', '').lower()
 
-        self.id = str(uuid.uuid4())
-        self.uuid = body.get(self._field_key('uuid'))
-        self.type = body.get(self._field_key('type'))
-        self.metadata = body.get(self._field_key('metadata'))
-        self.data_location = body.get(self._field_key('data_location'))
-        self.meta_location = body.get(self._field_key('meta_location'))
+        fields = {name: dict(field or {}) for name, field in config.get('fields', MSG_FIELDS).items()}
+        fields.setdefault('data_location', {}).update({'required': True})  # Enforce requirement of data location
+        self.fields = fields
+
+        self.keys = {attr: (fields.get(field) or {}).get('key') or field for attr, field in ATTRIBUTE_FIELDS.items()}
+        self.required = frozenset(
+            (field.get('key') or name).lower() for name, field in fields.items() if field.get('required')
+        )
+
+    def missing_fields(self, body: dict):
+        if self.required.issubset(body.keys()):
+            return []
+
+        keys = {k.lower() for k in body.keys()}
 
-    def _field_key(self, field_name: str):
-        field = self.msg_fields.get(field_name) or {}
+        return [f for f in self.required if f not in keys]
 
-        return field.get('key') or field_name
+
+class Message:
+    __slots__ = ['body', 'hash_digest', 'id', 'uuid', 'type', 'metadata', 'data_location', 'meta_location']
+
+    def __init__(self, body: dict, config):
+        schema = config if isinstance(config, MessageSchema) else MessageSchema(config)
+        keys = schema.keys
+
+        self.body = body
+        self.hash_digest = None
+
+        self.id = str(uuid.uuid4())
+        self.uuid = body.get(keys['uuid'])
+        self.type = body.get(keys['type'])
+        self.metadata = body.get(keys['metadata'])
+        self.data_location = body.get(keys['data_location'])
+        self.meta_location = body.get(keys['meta_location'])
 
     def __str__(self):
         msg = {
@@ -1,31 +1,41 @@
 import json
 import logging
 
-from sqapi.messaging.message import Message
+from sqapi.messaging.message import Message, MessageSchema
 
 log = logging.getLogger(__name__)
 
 
 def parse_message(msg_body: bytes, cfg) -> Message:
-    parser = cfg.get('parser', {})
-    parser_type = parser.get('type', '')
+    """
+    Parses the message body by the message configuration
 
-    if parser_type.lower() == 'str' or parser_type.lower() == 'string':
-        out = _parse_string(parser, msg_body.decode('utf-8'))
+    :param msg_body: Message body as received, either bytes or a buffer of a received frame
+    :param cfg: Message configuration, preferably compiled once as a MessageSchema
+    :return: Validated message
+    """
+    schema = cfg if isinstance(cfg, MessageSchema) else MessageSchema(cfg)
+    parser_type = schema.parser_type
 
-    elif parser_type.lower() == 'json':
+    if isinstance(msg_body, memoryview):
+        # Decoded straight from the receive buffer, without copying the frame to bytes first
+        msg_body = str(msg_body, 'utf-8')
+
+    if parser_type == 'str' or parser_type == 'string':
+        out = _parse_string(schema.parser, msg_body.decode('utf-8') if isinstance(msg_body, bytes) else msg_body)
+
+    elif parser_type == 'json':
         out = json.loads(msg_body)
 
     else:
-        err = f'Parser ({parser}) not implemented' if parser else 'Parser not defined'
+        err = f'Parser ({schema.parser}) not implemented' if schema.parser else 'Parser not defined'
         log.error(err)
 
         raise NotImplementedError(err)
 
-    message = Message(out, cfg)
-    _validate_required_fields(message)
+    _validate_required_fields(out, schema)
 
-    return message
+    return Message(out, schema)
 
 
 def _parse_string(cfg, message):
@@ -41,21 +51,8 @@ def _parse_string(cfg, message):
     )
 
 
-def _validate_required_fields(message):
-    body = message.body
-    fields = message.msg_fields
-
-    required_fields = {
-        fields.get(f).get('key').lower() for f in fields
-        if fields.get(f).get('required')
-    }
-
-    missing_fields = [
-        f for f in required_fields
-        if f not in {
-            i.lower() for i in body.keys()
-        }
-    ]
+def _validate_required_fields(body: dict, schema: MessageSchema):
+    missing_fields = schema.missing_fields(body)
 
     if missing_fields:
         err = 'The following field(/s) are missing in the message: {}'.format(', '.join(missing_fields))
@@ -4,6 +4,7 @@ import os
 
 from sqapi.configuration import detector
 from sqapi.configuration.util import Config
+from sqapi.plugin.router import MimeRouter
 from sqapi.processing.processor import Processor
 
 log = logging.getLogger(__name__)
@@ -20,11 +21,8 @@ class PluginManager:
         self.unloaded_plugins = []
         self.register_plugins()
 
-        self.accepted_types = set()
-        for plugin in self.plugins:
-            supported_types = plugin.config.plugin.get('mime_types') or ['*']
-            log.debug('Plugin {} accepts mime types: {}'.format(plugin.name, supported_types))
-            self.accepted_types.update(supported_types)
+        self.router = MimeRouter(self.plugins)
+        self.accepted_types = self.router
 
     def register_plugins(self):
         log.debug('Searching for available and active plugins')
@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+import functools
+import logging
+from collections import defaultdict
+
+WILDCARDS = ['*', '*/*']
+ROUTE_CACHE_SIZE = 1024
+
+log = logging.getLogger(__name__)
+
+
+class MimeRouter:
+    """
+    Index from mime type to the plugins accepting it, built once when the plugins are registered.
+    Plugins may accept exact mime types (`image/png`), major types (`image/*`) or everything (`*`).
+
+    Behaves like the set of accepted mime types, so it can be used with `fileinfo.validate_mime_type`.
+    """
+
+    def __init__(self, plugins: list):
+        self.exact = defaultdict(list)
+        self.major = defaultdict(list)
+        self.wildcard = []
+        self.patterns = set()
+
+        for plugin in plugins:
+            supported_types = plugin.config.plugin.get('mime_types') or ['*']
+            log.debug('Plugin {} accepts mime types: {}'.format(plugin.name, supported_types))
+
+            for mime in supported_types:
+                self.patterns.add(mime)
+
+                if mime in WILDCARDS:
+                    self.wildcard.append(plugin)
+                elif mime.endswith('/*'):
+                    self.major[mime[:-2]].append(plugin)
+                else:
+                    self.exact[mime].append(plugin)
+
+        self.order = {id(plugin): i for i, plugin in enumerate(plugins)}
+        self.route = functools.lru_cache(maxsize=ROUTE_CACHE_SIZE)(self._route)
+
+    def _route(self, mime: str) -> tuple:
+        """
+        Plugins accepting the mime type, in the order the plugins were registered
+        """
+        major = mime.split('/', 1)[0] if mime else None
+        plugins = {id(p): p for p in self.exact.get(mime, []) + self.major.get(major, []) + self.wildcard}
+
+        return tuple(plugins[key] for key in sorted(plugins, key=self.order.get))
+
+    def __contains__(self, mime):
+        if mime in WILDCARDS:
+            return bool(self.wildcard)
+
+        return bool(self.route(mime))
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __iter__(self):
+        return iter(self.patterns)
+
+    def __repr__(self):
+        return 'MimeRouter({})'.format(sorted(self.patterns))
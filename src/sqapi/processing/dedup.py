@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import redis
+
+DEFAULT_TTL = 86400
+DEFAULT_MAX_ENTRIES = 100000
+EVICTION_INTERVAL = 1000
+
+log = logging.getLogger(__name__)
+
+
+def create_cache(config: dict):
+    """
+    Creates the cache of content already processed by each plugin, if configured
+
+    :param config: The dedup topic of the sqAPI configuration
+    :return: Cache implementing `processed` and `record`, or None when deduplication is disabled
+    """
+    cache_type = config.get('type')
+    if not cache_type:
+        log.debug('No deduplication cache defined in configuration')
+        return None
+
+    log.info('Using {} deduplication cache'.format(cache_type))
+    if cache_type == 'disk':
+        return DiskDedupCache(config)
+
+    if cache_type == 'redis':
+        return RedisDedupCache(config)
+
+    err = '{} is not a supported deduplication cache type'.format(cache_type)
+    log.warning(err)
+    raise AttributeError(err)
+
+
+class DiskDedupCache:
+    """
+    Local index of processed content, stored in SQLite to be shared between processes.
+    Entries expire after `ttl` seconds, while the least recently seen entries are evicted
+    when exceeding `max_entries`.
+    """
+
+    def __init__(self, config: dict):
+        self.path = config.get('path') or os.path.join(tempfile.gettempdir(), 'sqapi-dedup.db')
+        self.ttl = config.get('ttl', DEFAULT_TTL)
+        self.max_entries = config.get('max_entries', DEFAULT_MAX_ENTRIES)
+
+        self.local = threading.local()
+        self.records = 0
+
+        with self._connection() as con:
+            con.execute(
+                'CREATE TABLE IF NOT EXISTS processed ('
+                'plugin TEXT, version TEXT, digest TEXT, seen REAL, '
+                'PRIMARY KEY (plugin, version, digest))'
+            )
+            con.execute('CREATE INDEX IF NOT EXISTS processed_seen ON processed (seen)')
+
+    def processed(self, plugin: str, version: str, digest: str) -> bool:
+        now = time.time()
+
+        with self._connection() as con:
+            cur = con.execute(
+                'UPDATE processed SET seen = ? WHERE plugin = ? AND version = ? AND digest = ? AND seen > ?',
+                (now, plugin, version or '', digest, now - self.ttl)
+            )
+
+            return cur.rowcount > 0
+
+    def record(self, plugin: str, version: str, digest: str):
+        with self._connection() as con:
+            con.execute(
+                'INSERT OR REPLACE INTO processed (plugin, version, digest, seen) VALUES (?, ?, ?, ?)',
+                (plugin, version or '', digest, time.time())
+            )
+
+        self.records += 1
+        if self.records % EVICTION_INTERVAL == 0:
+            self.evict()
+
+    def evict(self):
+        log.debug('Evicting expired and least recently seen deduplication entries')
+
+        with self._connection() as con:
+            con.execute('DELETE FROM processed WHERE seen <= ?', (time.time() - self.ttl,))
+            con.execute(
+                'DELETE FROM processed WHERE rowid IN ('
+                'SELECT rowid FROM processed ORDER BY seen DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+    def _connection(self):
+        # SQLite connections can neither be shared between threads, nor survive a fork
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.connection = sqlite3.connect(self.path, timeout=30)
+            self.local.pid = os.getpid()
+
+        return self.local.connection
+
+
+class RedisDedupCache:
+    """
+    Index of processed content stored in Redis, shared between sqAPI instances.
+    Entries expire after `ttl` seconds, which is renewed each time the content is seen.
+    Configure the Redis eviction policy (eg. allkeys-lru) to bound the memory usage.
+    """
+
+    def __init__(self, config: dict):
+        self.ttl = config.get('ttl', DEFAULT_TTL)
+        self.prefix = config.get('prefix', 'sqapi:dedup')
+        self.redis = redis.Redis(
+            host=config.get('host', 'localhost'),
+            port=config.get('port', 6379),
+            max_connections=config.get('max_connections', 50),
+        )
+
+    def processed(self, plugin: str, version: str, digest: str) -> bool:
+        return bool(self.redis.expire(self._key(plugin, version, digest), self.ttl))
+
+    def record(self, plugin: str, version: str, digest: str):
+        self.redis.set(self._key(plugin, version, digest), 1, ex=self.ttl)
+
+    def _key(self, plugin, version, digest):
+        return ':'.join([self.prefix, plugin, version or '', digest])
@@ -1,21 +1,20 @@
-import copy
-import hashlib
+import asyncio
 import json
 import logging
-import multiprocessing
 import threading
-import time
+from concurrent.futures import ThreadPoolExecutor
 
 from sqapi.configuration import detector, fileinfo
 from sqapi.configuration.util import Config
 from sqapi.configuration.util import signal_blocker
 from sqapi.messaging import util
-from sqapi.messaging.message import Message
+from sqapi.messaging.dispatcher import DEFAULT_MAX_IN_FLIGHT
+from sqapi.messaging.message import Message, MessageSchema
 from sqapi.plugin.manager import PluginManager
-from sqapi.processing.exception import SqapiPluginExecutionError, PluginFailure
-from sqapi.query import data, meta
-
-CHUNK_SIZE = 65536
+from sqapi.processing import dedup
+from sqapi.processing.exception import PluginFailure, SqapiPluginExecutionError
+from sqapi.processing.worker import PluginWorkerPool, serialize
+from sqapi.query import data, meta, stream
 
 log = logging.getLogger(__name__)
 
@@ -24,10 +23,27 @@ class ProcessManager:
     def __init__(self, config: Config, plugin_manager: PluginManager):
         self.config = config
         self.plugin_manager = plugin_manager
+        self.message_schema = MessageSchema(self.config.message)
+        self.worker_pools = dict()
+        self.dedup_cache = None
+        self.query_executor = ThreadPoolExecutor(
+            max_workers=self.config.broker.get('max_in_flight', DEFAULT_MAX_IN_FLIGHT), thread_name_prefix='Query'
+        )
 
-        self.listener = detector.detect_listener(self.config.broker, self.process_message)
+        # Coroutines lets many messages wait for content and metadata, without a thread each
+        process_message = self.process_message_async if self.config.broker.get('asyncio') else self.process_message
+        self.listener = detector.detect_listener(self.config.broker, process_message, self.process_batch)
 
     def start_subscribing(self):
+        detector.register_connectors(self.config)
+        self.dedup_cache = dedup.create_cache(self.config.dedup)
+
+        log.info('Starting plugin worker pools')
+        for plugin in self.plugin_manager.plugins:
+            pool = PluginWorkerPool(plugin, plugin.config.plugin.get('workers', 1))
+            pool.start()
+            self.worker_pools[plugin.name] = pool
+
         log.info('Starting message subscription')
 
         threading.Thread(
@@ -36,20 +52,45 @@ class ProcessManager:
         ).start()
         log.debug('Message subscription started')
 
-    def process_message(self, body: bytes):
+    def process_message(self, body: bytes, specific_plugin: str = None):
+        download = None
+
         try:
-            message = util.parse_message(body, self.config.message)
+            message = util.parse_message(body, self.message_schema)
 
             log.info('Message processing started')
-            data_path, metadata = self.query(message)
+            download, metadata = self.query(message)
+            self.prepare_message(message, download, metadata)
 
-            message.type = message.type or fileinfo.get_mime_type(data_path, metadata, self.config.message)
-            fileinfo.validate_mime_type(message.type, self.plugin_manager.accepted_types)
+            with signal_blocker():
+                self.execute_plugins(download.path, message, metadata, specific_plugin)
+
+            log.info('Processing completed')
+
+        except LookupError as e:
+            log.warning('Could not fetch content and/or metadata at this point: {}'.format(str(e)))
+            raise e
+
+        except Exception as e:
+            log.error('Could not process message: {}'.format(str(e)))
+            raise e
+
+        finally:
+            if download:
+                data.discard(download)
 
-            message.hash_digest = self._calculate_hash_digest(data_path)
+    async def process_message_async(self, body: bytes, specific_plugin: str = None):
+        download = None
+
+        try:
+            message = util.parse_message(body, self.message_schema)
+
+            log.info('Message processing started')
+            download, metadata = await self.query_async(message)
+            self.prepare_message(message, download, metadata)
 
             with signal_blocker():
-                self.execute_plugins(data_path, message, metadata)
+                await self.execute_plugins_async(download.path, message, metadata, specific_plugin)
 
             log.info('Processing completed')
 
@@ -61,96 +102,288 @@ class ProcessManager:
             log.error('Could not process message: {}'.format(str(e)))
             raise e
 
-    def execute_plugins(self, data_path, message, metadata):
-        log.debug('Creating processor pool of plugin executions')
+        finally:
+            if download:
+                data.discard(download)
+
+    def process_batch(self, items: list):
+        """
+        Processes a batch of messages, letting each plugin execute all messages it accepts at once
+
+        :param items: List of (body, specific_plugin) tuples, as received by process_message
+        :return: List in the same order as the items, with None or the exception of each message
+        """
+        log.info('Batch processing of {} messages started'.format(len(items)))
+        results = [None] * len(items)
+        downloading = dict()
+
+        try:
+            messages = dict()
+            for i, (body, *args) in enumerate(items):
+                try:
+                    message = util.parse_message(body, self.message_schema)
+                    self.reject_before_download(message)
+                    messages[i] = (message, args[0] if args else None)
+
+                except Exception as e:
+                    log.warning('Could not process message in batch: {}'.format(str(e)))
+                    results[i] = e
+
+            # Metadata is fetched in bulk first, so content is only downloaded for the accepted messages
+            fetched = self.query_metadata_many([message for message, _ in messages.values()])
+
+            accepted = dict()
+            for (i, (message, specific_plugin)), metadata in zip(messages.items(), fetched):
+                try:
+                    if isinstance(metadata, Exception):
+                        raise metadata
+
+                    self.reject_unsupported(message, metadata)
+                    accepted[i] = (message, metadata, specific_plugin)
+
+                except Exception as e:
+                    log.warning('Could not process message in batch: {}'.format(str(e)))
+                    results[i] = e
+
+            for i, (message, _, _) in accepted.items():
+                downloading[i] = self.query_executor.submit(data.download_data, self.config, message)
+
+            ready = dict()
+            for i, (message, metadata, specific_plugin) in accepted.items():
+                try:
+                    download = downloading[i].result()
+                    self.prepare_message(message, download, metadata)
+                    ready[i] = (message, metadata, download.path, specific_plugin)
+
+                except Exception as e:
+                    log.warning('Could not fetch content of message in batch: {}'.format(str(e)))
+                    results[i] = e
+
+            with signal_blocker():
+                failures = self.execute_plugins_batch(ready)
 
-        with multiprocessing.Manager() as manager:
-            failed = manager.dict()
-            process_pool = [
-                multiprocessing.Process(target=self.plugin_execution, args=[
-                    plugin, message, metadata, data_path, failed
-                ]) for plugin in self.plugin_manager.plugins
-                if self.valid_data_type(message, plugin)
-            ]
+            for i, failed in failures.items():
+                results[i] = SqapiPluginExecutionError(failed)
 
-            log.debug('Starting processor pool')
-            [t.start() for t in process_pool]
-            [t.join() for t in process_pool]
+            log.info('Batch processing completed, {} of {} messages failed'.format(
+                len([r for r in results if r]), len(items)
+            ))
+            return results
 
-            if failed:
-                raise SqapiPluginExecutionError([failed[k] for k in failed])
+        finally:
+            # Downloads still in progress are discarded once completed
+            for downloaded in downloading.values():
+                downloaded.add_done_callback(self._discard_download)
+
+    def prepare_message(self, message: Message, download, metadata):
+        message.type = message.type or fileinfo.get_mime_type(
+            download.path, metadata, self.config.message, download.header
+        )
+        fileinfo.validate_mime_type(message.type, self.plugin_manager.accepted_types)
+
+        message.hash_digest = download.hash_digest
+
+    def execute_plugins(self, data_path, message, metadata, specific_plugin=None):
+        log.debug('Submitting message to plugin worker pools')
+
+        plugins = self.accepting_plugins(message, specific_plugin)
+        payload = serialize(message, metadata)
+        pending = [self.worker_pools[plugin.name].submit(payload, data_path) for plugin in plugins]
+
+        self.complete_plugins(plugins, message, [p.wait() for p in pending])
+
+    async def execute_plugins_async(self, data_path, message, metadata, specific_plugin=None):
+        log.debug('Submitting message to plugin worker pools')
+        loop = asyncio.get_running_loop()
+
+        # The dedup cache blocks on its store, so it is kept off the event loop
+        plugins = await loop.run_in_executor(None, self.accepting_plugins, message, specific_plugin)
+        payload = serialize(message, metadata)
+        pending = [self.worker_pools[plugin.name].submit(payload, data_path) for plugin in plugins]
+
+        results = await asyncio.gather(*[asyncio.wrap_future(p.future) for p in pending])
+        await loop.run_in_executor(None, self.complete_plugins, plugins, message, results)
+
+    def complete_plugins(self, plugins: list, message: Message, results: list):
+        failed = [f for f in results if f]
+        for plugin in plugins:
+            if plugin.name not in {f.plugin for f in failed}:
+                self.record_processed(plugin, message)
+
+        if failed:
+            raise SqapiPluginExecutionError(failed)
+
+    def execute_plugins_batch(self, ready: dict):
+        log.debug('Submitting batch of {} messages to plugin worker pools'.format(len(ready)))
+
+        accepting = {i: self.accepting_plugins(message, sp) for i, (message, _, _, sp) in ready.items()}
+        payloads = {i: serialize(message, metadata) for i, (message, metadata, _, _) in ready.items()}
+
+        submitted = []
+        for plugin in self.plugin_manager.plugins:
+            indexes = [i for i in ready if plugin in accepting[i]]
+            if indexes:
+                items = [(payloads[i], ready[i][2]) for i in indexes]
+                submitted.append((plugin, indexes, self.worker_pools[plugin.name].submit_batch(items)))
+
+        failures = dict()
+        for plugin, indexes, pending in submitted:
+            results = pending.wait()
+            if len(results) != len(indexes):
+                err = ValueError('Batch execution reported {} results for {} messages'.format(
+                    len(results), len(indexes)
+                ))
+                results = [PluginFailure(plugin.name, err)] * len(indexes)
+
+            for i, failure in zip(indexes, results):
+                if failure:
+                    failures.setdefault(i, []).append(failure)
+                else:
+                    self.record_processed(plugin, ready[i][0])
+
+        return failures
+
+    def accepting_plugins(self, message: Message, specific_plugin=None):
+        return [
+            plugin for plugin in self.plugin_manager.router.route(message.type)
+            if (not specific_plugin or specific_plugin == plugin.name)
+            and not self.already_processed(plugin, message)
+        ]
+
+    def already_processed(self, plugin, message: Message):
+        if not self.dedup_cache:
+            return False
+
+        if self.dedup_cache.processed(plugin.name, plugin.config.plugin.get('version'), message.hash_digest):
+            log.info('{} has already processed content {}, skipping'.format(plugin.name, message.hash_digest))
+            return True
+
+        return False
+
+    def record_processed(self, plugin, message: Message):
+        if self.dedup_cache:
+            self.dedup_cache.record(plugin.name, plugin.config.plugin.get('version'), message.hash_digest)
 
     def query(self, message: Message):
         log.info('Querying metadata and content stores')
 
-        data_path = data.download_data(self.config, message)
+        self.reject_before_download(message)
 
-        if message.metadata:
-            log.info('Loading metadata from message')
-            metadata = json.loads(message.metadata)
+        # Content is downloaded while metadata is fetched, and cancelled if the message turns out to be rejected
+        cancelled = threading.Event()
+        downloading = self.query_executor.submit(self.download_data, message, cancelled)
 
-        elif self.config.meta_store:
-            log.info('Fetching metadata by query')
-            metadata = meta.fetch_metadata(self.config, message)
+        try:
+            metadata = self.query_metadata(message)
+            self.reject_unsupported(message, metadata)
 
-        else:
-            log.debug('No metadata storage defined in configuration, skipping metadata retrieval')
-            metadata = {}
+        except BaseException:
+            cancelled.set()
+            downloading.add_done_callback(self._discard_download)
+            raise
+
+        download = downloading.result()
 
         log.debug('Queries completed')
-        return data_path, metadata
+        return download, metadata
 
-    @staticmethod
-    def plugin_execution(plugin, message, metadata, data_path, failed):
-        log.info('{} started processing on {}'.format(plugin.name, message.uuid))
-        start = time.time()
+    async def query_async(self, message: Message):
+        log.info('Querying metadata and content stores')
+        loop = asyncio.get_running_loop()
 
-        timeout_seconds = plugin.config.plugin.get('timeout', 300)
-        timeout_message = f'{message.uuid} in {plugin.name}, used more execution time than threshold'
+        await loop.run_in_executor(None, self.reject_before_download, message)
+
+        cancelled = threading.Event()
+        downloading = loop.run_in_executor(None, self.download_data, message, cancelled)
 
         try:
-            with open(data_path, 'rb') as open_file:
-                with Timeout(seconds=timeout_seconds, error_message=timeout_message):
-                    plugin.execute(
-                        plugin.config,
-                        plugin.database,
-                        copy.deepcopy(message),
-                        copy.deepcopy(metadata),
-                        open(data_path, 'rb')
-                    )
-
-        except TimeoutError as e:
-            log.warning(f'{plugin.name} timed out processing {message.uuid}: {str(e)}')
-            failed[plugin.name] = PluginFailure(plugin.name, e)
+            metadata = await loop.run_in_executor(None, self.query_metadata, message)
+            self.reject_unsupported(message, metadata)
 
-        except Exception as e:
-            log.warning(f'{plugin.name} failed processing {message.uuid}: {str(e)}')
-            failed[plugin.name] = PluginFailure(plugin.name, e)
+        except BaseException:
+            cancelled.set()
+            downloading.add_done_callback(self._discard_download)
+            raise
 
-        finally:
-            run_time = (time.time() - start) * 1000.0
-            log.info(f'{plugin.name} used {run_time} (milliseconds) processing {message.uuid}')
+        download = await downloading
 
-    @staticmethod
-    def _calculate_hash_digest(file_path):
-        digest = hashlib.sha256()
+        log.debug('Queries completed')
+        return download, metadata
+
+    def download_data(self, message: Message, cancelled: threading.Event):
+        with stream.cancellable(cancelled):
+            return data.download_data(self.config, message)
+
+    def reject_before_download(self, message: Message):
+        """
+        Rejects messages of unsupported mime types, by what is known before downloading the content:
+        The type within the message, the mime within inline metadata, a trusted file extension,
+        or the leading bytes of the content for connectors supporting partial reads
+        """
+        accepted_types = self.plugin_manager.accepted_types
+        if fileinfo.accepts_all(accepted_types):
+            return
+
+        mime = message.type
+        if not mime and message.metadata:
+            mime = fileinfo.mime_from_metadata(json.loads(message.metadata), self.config.message)
+
+        elif not mime and self.config.meta_store and (self.config.message.get('mime') or {}).get('path'):
+            # The mime within metadata not yet fetched takes precedence over guessing by the content
+            return
+
+        if not mime and (self.config.message.get('mime') or {}).get('trust_extension'):
+            mime = fileinfo.mime_from_extension(message.data_location)
 
-        with open(file_path, 'rb') as f:
-            while True:
-                chunk = f.read(CHUNK_SIZE)
+        if not mime:
+            mime = fileinfo.mime_from_header(data.fetch_header(self.config, message))
 
-                if not chunk:
-                    break
+        if mime:
+            log.debug('Mime type {} known before downloading content'.format(mime))
+            fileinfo.validate_mime_type(mime, accepted_types)
 
-                digest.update(chunk)
+    def reject_unsupported(self, message: Message, metadata):
+        mime = message.type or fileinfo.mime_from_metadata(metadata, self.config.message)
 
-        return digest.hexdigest()
+        if mime:
+            fileinfo.validate_mime_type(mime, self.plugin_manager.accepted_types)
 
     @staticmethod
-    def valid_data_type(message: Message, plugin):
-        accepted_types = plugin.config.plugin.get('mime_types') or []
+    def _discard_download(future):
+        if future.cancelled() or future.exception():
+            return
 
-        return message.type in accepted_types or not accepted_types
+        data.discard(future.result())
+
+    def query_metadata_many(self, messages: list):
+        fetched = dict()
+
+        remote = [(i, m) for i, m in enumerate(messages) if not m.metadata]
+        if remote and self.config.meta_store:
+            log.info('Fetching metadata for {} messages by query'.format(len(remote)))
+            fetched = dict(zip([i for i, _ in remote], meta.fetch_metadata_many(self.config, [m for _, m in remote])))
+
+        return [fetched[i] if i in fetched else self._query_inline_metadata(m) for i, m in enumerate(messages)]
+
+    def _query_inline_metadata(self, message: Message):
+        try:
+            return self.query_metadata(message)
+
+        except Exception as e:
+            return e
+
+    def query_metadata(self, message: Message):
+        if message.metadata:
+            log.info('Loading metadata from message')
+            return json.loads(message.metadata)
+
+        elif self.config.meta_store:
+            log.info('Fetching metadata by query')
+            return meta.fetch_metadata(self.config, message)
+
+        else:
+            log.debug('No metadata storage defined in configuration, skipping metadata retrieval')
+            return {}
 
     @staticmethod
     def _get_default_filetype():
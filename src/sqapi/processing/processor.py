@@ -1,5 +1,6 @@
 #! /usr/bin/env python
 import importlib
+import inspect
 import logging
 import os
 
@@ -29,6 +30,11 @@ class Processor:
         plugin = importlib.import_module(plugin)
 
         self.execute = plugin.execute
+        self.execute_batch = getattr(plugin, 'execute_batch', None)
+
+        # Memory mapped content is only offered to plugins asking for it
+        self.accepts_content = accepts_keyword(self.execute, 'content')
+        self.accepts_contents = accepts_keyword(self.execute_batch, 'contents')
         blueprints_dir = self.config.api.get('blueprints_directory', None)
         self.blueprints = util.load_blueprints(plugin_name, blueprints_dir)
 
@@ -51,3 +57,12 @@ class Processor:
             raise AttributeError('Database initialization script defined ({}) does not exist'.format(init_path))
 
         return init_path
+
+
+def accepts_keyword(function, keyword):
+    if not function:
+        return False
+
+    parameters = inspect.signature(function).parameters.values()
+
+    return any(p.name == keyword or p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters)
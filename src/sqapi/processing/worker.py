@@ -0,0 +1,429 @@
+#! /usr/bin/env python3
+import atexit
+import collections
+import itertools
+import logging
+import mmap
+import multiprocessing
+import os
+import pickle
+import signal
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import ExitStack, contextmanager
+from multiprocessing import connection
+
+from sqapi.configuration.util import Timeout
+from sqapi.processing.exception import PluginFailure
+
+TASK_STARTED = 'started'
+TASK_DONE = 'done'
+
+# Seconds allowed on top of the plugin timeout, before an unreported execution is failed
+TIMEOUT_GRACE = 10
+
+log = logging.getLogger(__name__)
+
+
+class PendingExecution:
+    def __init__(self, plugin_name: str, batch_size: int = None):
+        self.plugin = plugin_name
+        self.batch_size = batch_size
+        self.deadline = None
+        self.future = Future()
+
+    def complete(self, failure):
+        self.future.set_result(failure)
+
+    def fail(self, failure: PluginFailure):
+        self.complete(failure if self.batch_size is None else [failure] * self.batch_size)
+
+    def expired(self, now: float) -> bool:
+        return self.deadline is not None and now > self.deadline
+
+    def wait(self):
+        # Bounded by the pool, failing executions not reported within the plugin timeout
+        return self.future.result()
+
+
+class PluginWorkerPool:
+    """
+    Long-lived worker processes for a single plugin.
+    Each worker receives tasks over its own pipe, assigned by the pool when the worker is idle,
+    while a collector thread maps the results reported by each worker back to the pending executions.
+
+    Since no pipe is shared between the workers, a worker dying while receiving or reporting cannot block the others,
+    and the collector notices a dead worker as soon as it exits.
+    """
+
+    def __init__(self, plugin, size: int = 1):
+        self.plugin = plugin
+        self.size = max(int(size or 1), 1)
+        self.timeout = plugin.config.plugin.get('timeout', 300)
+
+        self.workers = []
+        self.tasks = dict()
+        self.results = dict()
+        self.queued = collections.deque()
+        self.idle = set()
+        self.dispatched = dict()
+        self.pending = dict()
+        self.assigned = dict()
+        self.task_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.closing = False
+        self.collector = None
+
+    def start(self):
+        log.info('Starting {} worker(s) for plugin {}'.format(self.size, self.plugin.name))
+        with self.lock:
+            self.workers = [self._spawn_worker() for _ in range(self.size)]
+
+        self.collector = threading.Thread(
+            name='{} Result Collector'.format(self.plugin.name),
+            target=self._collect_results,
+            daemon=True
+        )
+        self.collector.start()
+        atexit.register(self.close)
+
+    def submit(self, payload: bytes, data_path) -> PendingExecution:
+        """
+        Submits a message to be executed by the first available worker
+
+        :param payload: Message and metadata, serialized once by `serialize` for all plugins
+        :param data_path: Path of the downloaded content
+        :return: Pending execution, resulting in the failure or None
+        """
+        return self._submit(PendingExecution(self.plugin.name), plugin_execution, payload, data_path)
+
+    def submit_batch(self, items: list) -> PendingExecution:
+        """
+        Submits several messages to be executed together by a single worker
+
+        :param items: List of (payload, data_path) tuples
+        :return: Pending execution, resulting in a list with the failure (or None) of each item
+        """
+        return self._submit(PendingExecution(self.plugin.name, len(items)), plugin_batch_execution, items)
+
+    def _submit(self, pending, function, *args):
+        task_id = next(self.task_ids)
+
+        with self.lock:
+            if self.closing:
+                pending.fail(PluginFailure(self.plugin.name, ChildProcessError('Worker pool is closed')))
+                return pending
+
+            self.pending[task_id] = pending
+            self.queued.append((task_id, function, args))
+            self._dispatch()
+
+        return pending
+
+    def _dispatch(self):
+        # Called with the lock held, handing queued tasks to idle workers
+        while self.queued and self.idle:
+            pid = self.idle.pop()
+            task = self.queued.popleft()
+
+            try:
+                self.tasks[pid].send(task)
+            except OSError:
+                # The worker died while idle, and is replaced by the collector
+                self.queued.appendleft(task)
+                continue
+
+            pending = self.pending.get(task[0])
+            if pending:
+                pending.deadline = time.monotonic() + self.timeout * (pending.batch_size or 1) + TIMEOUT_GRACE
+            self.dispatched[pid] = task
+
+    def close(self):
+        with self.lock:
+            if self.closing:
+                return
+            self.closing = True
+
+        log.debug('Stopping workers for plugin {}'.format(self.plugin.name))
+
+        # The collector must not mistake the stopping workers for crashed ones
+        if self.collector:
+            self.collector.join(timeout=5)
+
+        for worker in self.workers:
+            try:
+                self.tasks[worker.pid].send(None)
+            except OSError:
+                log.debug('Worker {} for plugin {} already stopped'.format(worker.pid, self.plugin.name))
+
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+            self.tasks.pop(worker.pid).close()
+            self.results.pop(worker.pid).close()
+
+        with self.lock:
+            pending, self.pending = self.pending, dict()
+            self.queued.clear()
+
+        for execution in pending.values():
+            execution.fail(PluginFailure(self.plugin.name, ChildProcessError('Worker pool closed during execution')))
+
+    def _spawn_worker(self):
+        # Called with the lock held, or before the collector is started
+        task_receiver, task_sender = multiprocessing.Pipe(duplex=False)
+        result_receiver, result_sender = multiprocessing.Pipe(duplex=False)
+        worker = multiprocessing.Process(
+            name='{} Worker'.format(self.plugin.name),
+            target=_work,
+            args=[self.plugin, task_receiver, result_sender]
+        )
+        worker.start()
+
+        # Only the worker holds the other ends, so the pipes break when the worker exits
+        task_receiver.close()
+        result_sender.close()
+        self.tasks[worker.pid] = task_sender
+        self.results[worker.pid] = result_receiver
+        self.idle.add(worker.pid)
+
+        return worker
+
+    def _collect_results(self):
+        while True:
+            with self.lock:
+                if self.closing:
+                    return
+
+                workers = list(self.workers)
+                receivers = [self.results[worker.pid] for worker in workers]
+
+            ready = connection.wait(receivers + [worker.sentinel for worker in workers], timeout=1)
+
+            for receiver in receivers:
+                if receiver in ready:
+                    self._receive(receiver)
+
+            self._expire_executions()
+
+            if any(worker.sentinel in ready for worker in workers):
+                self._replace_dead_workers()
+
+    def _receive(self, receiver):
+        while receiver.poll():
+            try:
+                state, task_id, pid, failure = receiver.recv()
+            except EOFError:
+                return
+
+            with self.lock:
+                if state == TASK_STARTED:
+                    self.dispatched.pop(pid, None)
+                    self.assigned[pid] = task_id
+                    continue
+
+                self.assigned.pop(pid, None)
+                pending = self.pending.pop(task_id, None)
+
+                if pid in self.tasks:
+                    self.idle.add(pid)
+                    self._dispatch()
+
+            if pending:
+                pending.complete(failure)
+
+    def _expire_executions(self):
+        now = time.monotonic()
+        expired = []
+
+        with self.lock:
+            for worker in self.workers:
+                task = self.dispatched.get(worker.pid)
+                task_id = task[0] if task else self.assigned.get(worker.pid)
+                pending = self.pending.get(task_id)
+                if not pending or not pending.expired(now):
+                    continue
+
+                expired.append(self.pending.pop(task_id))
+
+                # The worker is unresponsive, and replaced once terminated
+                log.warning('Worker {} for plugin {} did not report within the timeout, stopping it'.format(
+                    worker.pid, self.plugin.name
+                ))
+                worker.terminate()
+
+        for pending in expired:
+            err = TimeoutError('Execution in {} was not reported within the timeout'.format(self.plugin.name))
+            pending.fail(PluginFailure(self.plugin.name, err))
+
+    def _replace_dead_workers(self):
+        workers = []
+        for worker in self.workers:
+            if worker.is_alive():
+                workers.append(worker)
+                continue
+
+            # Results reported before the worker exited are collected first
+            receiver = self.results[worker.pid]
+            self._receive(receiver)
+
+            with self.lock:
+                self.results.pop(worker.pid).close()
+                self.tasks.pop(worker.pid).close()
+                self.idle.discard(worker.pid)
+
+                # Tasks the worker never started are handed to another worker
+                task = self.dispatched.pop(worker.pid, None)
+                if task and task[0] in self.pending:
+                    self.queued.appendleft(task)
+
+                task_id = self.assigned.pop(worker.pid, None)
+                pending = self.pending.pop(task_id, None)
+
+            if pending:
+                err = ChildProcessError('Worker exited with code {} during execution'.format(worker.exitcode))
+                pending.fail(PluginFailure(self.plugin.name, err))
+
+            # Workers only exit cleanly when told to stop
+            if worker.exitcode == 0:
+                log.debug('Worker {} for plugin {} stopped'.format(worker.pid, self.plugin.name))
+                continue
+
+            log.warning('Worker {} for plugin {} died (exit code {}), starting a new one'.format(
+                worker.pid, self.plugin.name, worker.exitcode
+            ))
+            with self.lock:
+                workers.append(self._spawn_worker())
+
+        with self.lock:
+            self.workers = workers
+            self._dispatch()
+
+
+def _work(plugin, tasks, results):
+    # Shutdown is coordinated by the parent process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    while True:
+        try:
+            task = tasks.recv()
+        except EOFError:
+            break
+
+        if task is None:
+            break
+
+        task_id, function, args = task
+        results.send((TASK_STARTED, task_id, os.getpid(), None))
+
+        failure = function(plugin, *args)
+        results.send((TASK_DONE, task_id, os.getpid(), failure))
+
+    # Lets the database write buffered content before the worker exits
+    if hasattr(plugin.database, 'close'):
+        plugin.database.close()
+
+
+def serialize(message, metadata) -> bytes:
+    # Each worker deserializes its own copy, isolating the plugins without copying per plugin
+    return pickle.dumps((message, metadata), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def plugin_execution(plugin, payload, data_path):
+    message, metadata = pickle.loads(payload)
+
+    log.info('{} started processing on {}'.format(plugin.name, message.uuid))
+    start = time.time()
+
+    timeout_seconds = plugin.config.plugin.get('timeout', 300)
+    timeout_message = f'{message.uuid} in {plugin.name}, used more execution time than threshold'
+
+    try:
+        with ExitStack() as stack:
+            open_file = stack.enter_context(open(data_path, 'rb'))
+            kwargs = {'content': stack.enter_context(map_content(open_file))} if plugin.accepts_content else {}
+
+            with Timeout(seconds=timeout_seconds, error_message=timeout_message):
+                plugin.execute(
+                    plugin.config,
+                    plugin.database,
+                    message,
+                    metadata,
+                    open_file,
+                    **kwargs
+                )
+
+    except TimeoutError as e:
+        log.warning(f'{plugin.name} timed out processing {message.uuid}: {str(e)}')
+        return PluginFailure(plugin.name, e)
+
+    except (Exception, SystemExit) as e:
+        # Exiting from a plugin fails the message, rather than stopping the worker
+        log.warning(f'{plugin.name} failed processing {message.uuid}: {str(e)}')
+        return PluginFailure(plugin.name, e)
+
+    finally:
+        run_time = (time.time() - start) * 1000.0
+        log.info(f'{plugin.name} used {run_time} (milliseconds) processing {message.uuid}')
+
+
+def plugin_batch_execution(plugin, items):
+    if not plugin.execute_batch:
+        return [plugin_execution(plugin, payload, data_path) for payload, data_path in items]
+
+    log.info('{} started processing batch of {} messages'.format(plugin.name, len(items)))
+    start = time.time()
+
+    timeout_seconds = plugin.config.plugin.get('timeout', 300) * len(items)
+    timeout_message = f'Batch of {len(items)} messages in {plugin.name}, used more execution time than threshold'
+
+    try:
+        with ExitStack() as stack:
+            files = [stack.enter_context(open(data_path, 'rb')) for _, data_path in items]
+            batch = [(*pickle.loads(payload), f) for (payload, _), f in zip(items, files)]
+
+            kwargs = {}
+            if plugin.accepts_contents:
+                kwargs['contents'] = [stack.enter_context(map_content(f)) for f in files]
+
+            with Timeout(seconds=timeout_seconds, error_message=timeout_message):
+                errors = plugin.execute_batch(plugin.config, plugin.database, batch, **kwargs)
+
+        if errors is not None and len(errors) != len(items):
+            raise ValueError('Batch execution reported {} results for {} messages'.format(len(errors), len(items)))
+
+        # Plugins may report a failure (or None) for each item, in the same order as received
+        return [PluginFailure(plugin.name, e) if e else None for e in errors or [None] * len(items)]
+
+    except (Exception, SystemExit) as e:
+        log.warning(f'{plugin.name} failed processing batch of {len(items)} messages: {str(e)}')
+        return [PluginFailure(plugin.name, e)] * len(items)
+
+    finally:
+        run_time = (time.time() - start) * 1000.0
+        log.info(f'{plugin.name} used {run_time} (milliseconds) processing batch of {len(items)} messages')
+
+
+@contextmanager
+def map_content(file):
+    """
+    Maps the file read-only into memory, letting plugins slice the content without copying,
+    while the pages are shared with every other process mapping the same file
+    """
+    if os.fstat(file.fileno()).st_size == 0:
+        yield b''
+        return
+
+    content = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield content
+
+    finally:
+        try:
+            content.close()
+        except BufferError:
+            log.debug('Content is still referenced by the plugin, unmapped when released')
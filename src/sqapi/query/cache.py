@@ -0,0 +1,232 @@
+#! /usr/bin/env python3
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from sqapi.query import stream
+
+DEFAULT_MAX_SIZE = 1024 ** 3
+DEFAULT_TTL = 300
+EVICT_INTERVAL = 10
+META_SUFFIX = '.meta'
+
+log = logging.getLogger(__name__)
+
+
+class ContentCache:
+    """
+    Bounded on-disk cache of downloaded content, shared between all processes on the host.
+    Entries are keyed by data location, and the version (eg. ETag or mtime) when the connector provides one.
+    Unversioned entries expire after `ttl` seconds, and the least recently used entries are evicted
+    when the total size exceeds `max_size` bytes.
+
+    Content is handed out as hard links, so evicting an entry never affects a download in use.
+    Concurrent fetches of the same entry within a process share a single download,
+    while the cache directory is only scanned for eviction when the cache may have outgrown its size.
+    """
+
+    def __init__(self, config: dict):
+        self.path = config.get('path') or os.path.join(tempfile.gettempdir(), 'sqapi-cache')
+        self.max_size = config.get('max_size', DEFAULT_MAX_SIZE)
+        self.ttl = config.get('ttl', DEFAULT_TTL)
+
+        self.lock = threading.Lock()
+        self.in_flight = dict()
+        self.size = None
+        self.scanned = 0
+
+        os.makedirs(os.path.join(self.path, 'locks'), exist_ok=True)
+
+    def fetch(self, location: str, version: str, download) -> stream.Download:
+        """
+        Fetches content from the cache, or downloads and stores it when missing
+
+        :param location: Data location of the content
+        :param version: Version of the content at the location, or None if unknown
+        :param download: Function downloading the content, returning a Download
+        :return: Temporary Download of the content, to be discarded after use
+        """
+        key = self._key(location, version)
+        ttl = None if version else self.ttl
+
+        # Concurrent fetches of the same location waits for the first download, instead of repeating it
+        with self.lock:
+            downloading = self.in_flight.get(key)
+            if not downloading:
+                self.in_flight[key] = Future()
+
+        if downloading:
+            downloading.result()
+
+            # Content handed out by reference is not cached, and is fetched by each caller
+            return self._locked_lookup(key, location, ttl) or download()
+
+        try:
+            content = self._locked_lookup(key, location, ttl) or self._download(key, location, download)
+
+        except BaseException as e:
+            with self.lock:
+                self.in_flight.pop(key).set_exception(e)
+            raise
+
+        with self.lock:
+            self.in_flight.pop(key).set_result(None)
+
+        return content
+
+    def _download(self, key, location, download):
+        log.debug('Content of {} not found in cache, downloading'.format(location))
+        content = download()
+
+        if content.temporary:
+            # Only storing the entry holds the lock, so downloads of other entries are not held back
+            with self._locked(key[:2]):
+                self._store(key, location, content)
+
+            self._evict_if_full(os.stat(content.path).st_size)
+
+        return content
+
+    def _locked_lookup(self, key, location, ttl):
+        with self._locked(key[:2]):
+            cached = self._lookup(key, location, ttl)
+
+        if cached:
+            log.debug('Content of {} found in cache'.format(location))
+
+        return cached
+
+    def _lookup(self, key, location, ttl):
+        path = self._content_path(key, location)
+
+        try:
+            with open(path + META_SUFFIX) as f:
+                meta = json.load(f)
+
+            if ttl is not None and meta.get('stored', 0) < time.time() - ttl:
+                log.debug('Cached content of {} has expired'.format(location))
+                self._remove(path)
+                return None
+
+            link = _temporary_path(os.path.splitext(location)[-1])
+            _link_or_copy(path, link)
+            os.utime(path)
+
+        except FileNotFoundError:
+            return None
+
+        return stream.Download(link, meta.get('hash_digest'), bytes.fromhex(meta.get('header')), True)
+
+    def _store(self, key, location, content: stream.Download):
+        path = self._content_path(key, location)
+
+        try:
+            # Replaced atomically, the meta file is written last to mark the entry as complete
+            _link_or_copy(content.path, path + '.tmp')
+            os.replace(path + '.tmp', path)
+
+            with tempfile.NamedTemporaryFile('w', suffix=META_SUFFIX, dir=self.path, delete=False) as f:
+                json.dump({
+                    'location': location,
+                    'hash_digest': content.hash_digest,
+                    'header': content.header.hex(),
+                    'stored': time.time(),
+                }, f)
+            os.replace(f.name, path + META_SUFFIX)
+
+        except OSError as e:
+            log.warning('Could not cache content of {}: {}'.format(location, str(e)))
+
+    def _evict_if_full(self, added):
+        # Other processes store entries as well, so the directory is scanned again after an interval
+        with self.lock:
+            if self.size is not None:
+                self.size += added
+
+            if self.size is not None and self.size <= self.max_size and \
+                    time.monotonic() - self.scanned < EVICT_INTERVAL:
+                return
+
+            self.scanned = time.monotonic()
+
+        size = self._evict()
+
+        with self.lock:
+            self.size = size
+
+    def _evict(self):
+        with self._locked('evict'):
+            entries = []
+            for entry in os.scandir(self.path):
+                if entry.is_file() and not entry.name.endswith(META_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+            size = sum(e[1] for e in entries)
+            if size <= self.max_size:
+                return size
+
+            log.debug('Content cache exceeds {} bytes, evicting least recently used'.format(self.max_size))
+            for _, file_size, path in sorted(entries):
+                if size <= self.max_size:
+                    break
+
+                self._remove(path)
+                size -= file_size
+
+            return size
+
+    @staticmethod
+    def _remove(path):
+        for p in [path + META_SUFFIX, path]:
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def _locked(self, name):
+        with open(os.path.join(self.path, 'locks', name), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _content_path(self, key, location):
+        return os.path.join(self.path, key + os.path.splitext(location)[-1])
+
+    @staticmethod
+    def _key(location, version):
+        return hashlib.sha256('{}\0{}'.format(location, version or '').encode('utf-8')).hexdigest()
+
+
+def _temporary_path(suffix):
+    fd, path = tempfile.mkstemp(suffix)
+    os.close(fd)
+    os.remove(path)
+
+    return path
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+
+    except FileNotFoundError:
+        raise
+
+    except OSError as e:
+        log.debug('Could not link {}, falls back to copy: {}'.format(source, str(e)))
+        shutil.copyfile(source, target)
@@ -1,62 +1,122 @@
 #! /usr/bin/env python3
 import logging
 import os
-import tempfile
+import threading
 
 import swiftclient
 
+from sqapi.query import stream
+
 log = logging.getLogger(__name__)
 
+# Connections are not thread safe, so each thread keeps its own authenticated connection
+connections = threading.local()
+
+# Container where an object was last found, by object prefix
+container_cache = dict()
+
 
 def download_to_disk(config, object_ref):
+    connection = _get_connection(config)
+    chunk_size = config.data_store.get('chunk_size', stream.CHUNK_SIZE)
+
+    for container in _search_order(config, connection, object_ref):
+        log.debug('Looking for object {} in container {}'.format(object_ref, container))
+        res = _get_object_from_container(connection, container, object_ref, chunk_size)
+
+        if res:
+            log.debug('Found object {} in container {}'.format(object_ref, container))
+            container_cache[_object_prefix(object_ref)] = container
+
+            log.debug('Streaming Swift object to temporary file')
+            return stream.write_to_disk(res[1], os.path.splitext(object_ref)[-1])
+
+        log.debug('Could not find object {} in container {}'.format(object_ref, container))
+
+    err = 'Could not get object from either containers'
+    log.warning(err)
+    raise FileNotFoundError(err)
+
+
+def fetch_header(config, object_ref, size):
+    connection = _get_connection(config)
+    headers = {'Range': 'bytes=0-{}'.format(size - 1)}
+
+    for container in _search_order(config, connection, object_ref):
+        res = _get_object_from_container(connection, container, object_ref, None, headers)
+
+        if res:
+            container_cache[_object_prefix(object_ref)] = container
+            return res[1]
+
+    raise FileNotFoundError('Could not find object {} in either containers'.format(object_ref))
+
+
+def fetch_version(config, object_ref):
+    connection = _get_connection(config)
+
+    for container in _search_order(config, connection, object_ref):
+        try:
+            headers = connection.head_object(container, object_ref)
+        except swiftclient.ClientException:
+            continue
+
+        container_cache[_object_prefix(object_ref)] = container
+        return headers.get('etag')
+
+    raise FileNotFoundError('Could not find object {} in either containers'.format(object_ref))
+
+
+def _get_connection(config):
+    connection = getattr(connections, 'connection', None)
+    if connection:
+        return connection
+
     log.debug('Establishing connection to OpenStack Swift')
     try:
         connection = swiftclient.Connection(
             user=config.data_store.get('access_key_id'),
             key=config.data_store.get('secret_access_key'),
-            auth_version=config.data_store.get('auth_version'),
+            auth_version=config.data_store.get('auth_version', '1'),
             os_options=config.data_store.get('os_options') or dict(),
             authurl=config.data_store.get('auth_url', 'http://localhost:8080/auth/v1.0'),
             insecure=True if config.data_store.get('insecure') else False,
+            retries=config.data_store.get('retries', 5),
         )
     except Exception as e:
         err = 'Failed establish connection with OpenStack Swift: {}'.format(str(e))
         log.warning(err)
         raise type(e)(err)
 
-    res = _search_containers_for_object(config, connection, object_ref)
-    if not res:
-        err = 'Could not get object from either containers'
-        log.warning(err)
-        raise FileNotFoundError(err)
+    connections.connection = connection
 
-    log.debug('Creating temporary file for Swift object download')
-    fd, path = tempfile.mkstemp(os.path.splitext(object_ref)[-1])
-    os.write(fd, res[1])
-    os.close(fd)
+    return connection
 
-    return path
 
+def _search_order(config, connection, object_ref):
+    cached = container_cache.get(_object_prefix(object_ref))
+    if cached:
+        yield cached
 
-def _search_containers_for_object(config, connection, object_ref):
     containers = config.data_store.get('containers')
     if not containers:
         log.debug('No container defined in config, searching all containers available')
-        containers = connection.get_account()[-1]
+        containers = connection.get_account(full_listing=True)[-1]
 
     for c in containers:
-        log.debug('Looking for object {} in container {}'.format(object_ref, c.get('name')))
-        res = _get_object_from_container(connection, c.get('name'), object_ref)
+        name = c.get('name') if isinstance(c, dict) else c
+
+        if name != cached:
+            yield name
 
-        if res:
-            log.debug('Found object {} in container {}'.format(object_ref, c.get('name')))
-            return res
 
-        log.debug('Could not find object {} in container {}'.format(object_ref, c.get('name')))
+def _object_prefix(object_ref):
+    return object_ref.rsplit('/', 1)[0] if '/' in object_ref else ''
 
 
-def _get_object_from_container(connection, container, object_ref):
+def _get_object_from_container(connection, container, object_ref, chunk_size, headers=None):
     try:
-        return connection.get_object(container, object_ref)
+        return connection.get_object(container, object_ref, resp_chunk_size=chunk_size, headers=headers)
     except swiftclient.ClientException as e:
         log.debug('Failed while getting object {} from container {}: {}'.format(object_ref, container, str(e)))
+
@@ -1,13 +1,20 @@
 #! /usr/bin/env python3
 import logging
+import os
+import threading
 
 from sqapi.configuration import detector
 from sqapi.messaging.message import Message
+from sqapi.query import stream
+from sqapi.query.cache import ContentCache
 
 log = logging.getLogger(__name__)
 
+content_cache = None
+content_cache_lock = threading.Lock()
 
-def download_data(config, message: Message):
+
+def download_data(config, message: Message) -> stream.Download:
     loc = message.data_location
     if not loc:
         err = 'Could not find "data_location" in message'
@@ -16,15 +23,75 @@ def download_data(config, message: Message):
 
     try:
         data_store = detector.detect_data_connectors(config.data_store)
+        cache = _get_content_cache(config)
+
+        if not cache:
+            return _download(config, data_store, loc)
 
-        disk_loc = data_store.download_to_disk(config, loc)
+        # Connectors may tell the version of the content, eg. ETag or mtime, to detect changed content
+        version = data_store.fetch_version(config, loc) if hasattr(data_store, 'fetch_version') else None
 
-        return disk_loc
+        return cache.fetch(loc, version, lambda: _download(config, data_store, loc))
     except FileNotFoundError as e:
         err = 'Data by reference {} was not available at this moment: {}'.format(loc, str(e))
         log.warning(err)
         raise LookupError(err)
 
 
+def fetch_header(config, message: Message, size=stream.HEADER_SIZE):
+    """
+    Fetches the leading bytes of the content, for connectors supporting partial reads.
+    Enabled by default for local connectors only, as remote connectors use an extra request per message.
+
+    :return: The leading bytes, or None when the connector does not support partial reads or sniffing is disabled
+    """
+    data_store = detector.detect_data_connectors(config.data_store)
+    if not config.data_store.get('sniff_header', getattr(data_store, 'LOCAL_READS', False)):
+        return None
+
+    if not hasattr(data_store, 'fetch_header'):
+        return None
+
+    try:
+        return data_store.fetch_header(config, message.data_location, size)
+
+    except FileNotFoundError as e:
+        err = 'Data by reference {} was not available at this moment: {}'.format(message.data_location, str(e))
+        log.warning(err)
+        raise LookupError(err)
+
+
+def _download(config, data_store, loc) -> stream.Download:
+    download = data_store.download_to_disk(config, loc)
+
+    if isinstance(download, stream.Download):
+        return download
+
+    # Connectors only returning the path of a temporary file
+    return stream.read_from_disk(download, temporary=True)
+
+
+def _get_content_cache(config):
+    global content_cache
+
+    cache_config = config.data_store.get('cache')
+    if not cache_config:
+        return None
+
+    if not content_cache:
+        with content_cache_lock:
+            if not content_cache:
+                log.info('Caching downloaded content on disk')
+                content_cache = ContentCache(cache_config)
+
+    return content_cache
+
+
+def discard(download: stream.Download):
+    if download.temporary and os.path.exists(download.path):
+        log.debug('Removing temporary file {}'.format(download.path))
+        os.remove(download.path)
+
+
 def fetch_file_from_disk(file):
     return open(file, "rb")
@@ -25,3 +25,44 @@ def fetch_metadata(config, message: Message):
         err = 'Metadata by reference {} was not available at this moment: {}'.format(loc, str(e))
         log.warning(err)
         raise LookupError(err)
+
+
+def fetch_metadata_many(config, messages: list):
+    """
+    Fetches metadata for a batch of messages, in a single request when the connector supports it
+
+    :return: List in the same order as the messages, with either the metadata or the error of each message
+    """
+    meta_store = detector.detect_metadata_connectors(config.meta_store)
+
+    if not hasattr(meta_store, 'fetch_metadata_many'):
+        return [_fetch_or_error(config, message) for message in messages]
+
+    results = [AttributeError('Could not find "meta_location" in message') for _ in messages]
+    located = [i for i, message in enumerate(messages) if message.meta_location]
+
+    refs = [messages[i].meta_location for i in located]
+    for i, ref, out in zip(located, refs, meta_store.fetch_metadata_many(config, refs)):
+        results[i] = _decode_or_error(ref, out)
+
+    return results
+
+
+def _decode_or_error(ref, out):
+    if not out:
+        return LookupError('Metadata by reference {} was not available at this moment'.format(ref))
+
+    try:
+        return json.loads(out)
+
+    except ValueError as e:
+        log.warning('Metadata by reference {} could not be decoded: {}'.format(ref, str(e)))
+        return e
+
+
+def _fetch_or_error(config, message: Message):
+    try:
+        return fetch_metadata(config, message)
+
+    except Exception as e:
+        return e
@@ -1,17 +1,18 @@
 #! /usr/bin/env python3
 import logging
+import threading
 
 import redis
 
 log = logging.getLogger(__name__)
 
+pool = None
+pool_lock = threading.Lock()
+
 
 def fetch_metadata(config, reference):
     log.debug('Fetching metadata from Redis')
-    host = config.meta_store.get('host', 'localhost')
-    port = config.meta_store.get('port', 6379)
-    log.debug('Connecting to redis on {}:{}'.format(host, port))
-    r = redis.Redis(host=host, port=port)
+    r = _get_client(config)
 
     res = r.get(reference)
 
@@ -20,3 +21,45 @@ def fetch_metadata(config, reference):
         raise LookupError('Metadata by reference {} was not available at this moment'.format(reference))
 
     return res
+
+
+def fetch_metadata_many(config, references):
+    """
+    Fetches metadata for several references in a single round-trip
+
+    :param config: sqAPI configuration, containing the meta_store topic
+    :param references: List of keys to fetch metadata by
+    :return: List of results in the same order as the references, None where metadata is missing
+    """
+    log.debug('Fetching metadata for {} references from Redis'.format(len(references)))
+    if not references:
+        return []
+
+    r = _get_client(config)
+
+    return r.mget(references)
+
+
+def _get_client(config):
+    global pool
+
+    if not pool:
+        with pool_lock:
+            if not pool:
+                pool = _create_pool(config)
+
+    return redis.Redis(connection_pool=pool)
+
+
+def _create_pool(config):
+    host = config.meta_store.get('host', 'localhost')
+    port = config.meta_store.get('port', 6379)
+    log.debug('Creating connection pool towards redis on {}:{}'.format(host, port))
+
+    return redis.ConnectionPool(
+        host=host,
+        port=port,
+        max_connections=config.meta_store.get('max_connections', 50),
+        socket_timeout=config.meta_store.get('socket_timeout', None),
+        socket_connect_timeout=config.meta_store.get('socket_connect_timeout', None),
+    )
@@ -0,0 +1,114 @@
+#! /usr/bin/env python3
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+CHUNK_SIZE = 65536
+
+# Number of leading bytes needed by filetype to recognize any supported type
+HEADER_SIZE = 261
+
+log = logging.getLogger(__name__)
+
+# Cancellation event of the download running in the current thread, if any
+local = threading.local()
+
+# Downloaded content, with its hash digest and leading bytes captured while written to disk.
+# Temporary downloads are removed after processing.
+Download = namedtuple('Download', ['path', 'hash_digest', 'header', 'temporary'])
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+@contextmanager
+def cancellable(cancelled: threading.Event):
+    """
+    Lets downloads in the current thread be aborted between chunks, when the event is set
+    """
+    local.cancelled = cancelled
+    try:
+        yield
+    finally:
+        local.cancelled = None
+
+
+def _check_cancelled():
+    cancelled = getattr(local, 'cancelled', None)
+    if cancelled and cancelled.is_set():
+        raise DownloadCancelled('Download was cancelled')
+
+
+class DigestWriter:
+    def __init__(self, file):
+        self.file = file
+        self.digest = hashlib.sha256()
+        self.header = b''
+
+    def write(self, chunk):
+        _check_cancelled()
+        self.digest.update(chunk)
+
+        if len(self.header) < HEADER_SIZE:
+            self.header += bytes(chunk[:HEADER_SIZE - len(self.header)])
+
+        self.file.write(chunk)
+
+
+def write_to_disk(chunks, suffix='') -> Download:
+    """
+    Writes the chunks to a temporary file, while calculating the hash digest and capturing the header
+
+    :param chunks: Iterable of bytes, eg. a streamed response body
+    :param suffix: Suffix of the temporary file, usually the file extension
+    :return: Download of the temporary file
+    """
+    fd, path = tempfile.mkstemp(suffix)
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            writer = DigestWriter(f)
+            for chunk in chunks:
+                writer.write(chunk)
+
+    except Exception:
+        os.remove(path)
+        raise
+
+    return Download(path, writer.digest.hexdigest(), writer.header, True)
+
+
+def read_from_disk(path, temporary=False) -> Download:
+    """
+    Reads an existing file once, calculating the hash digest and capturing the header
+
+    :param path: Path of the file
+    :param temporary: Whether the file should be removed after processing
+    :return: Download of the existing file
+    """
+    writer = DigestWriter(_NullFile())
+    for chunk in read_chunks(path):
+        writer.write(chunk)
+
+    return Download(path, writer.digest.hexdigest(), writer.header, temporary)
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+
+            if not chunk:
+                break
+
+            yield chunk
+
+
+class _NullFile:
+    def write(self, chunk):
+        pass
@@ -1,8 +1,13 @@
 #! /usr/bin/env python3
 import json
 import logging
+import os
+import threading
+import time
 
-from elasticsearch import Elasticsearch, Transport
+from elasticsearch import Elasticsearch, Transport, helpers
+
+RETRYABLE_STATUS = 429
 
 log = logging.getLogger(__name__)
 
@@ -10,6 +15,17 @@ log = logging.getLogger(__name__)
 class Database:
     def __init__(self, config: dict):
         self.cfg = config
+        self.health_check_interval = config.get('health_check_interval', 30)
+        self.last_health_check = 0
+
+        bulk_cfg = config.get('bulk') or {}
+        self.bulk_size = bulk_cfg.get('size', 500)
+        self.bulk_interval = bulk_cfg.get('interval', 1000)
+        self.bulk_max_buffer = bulk_cfg.get('max_buffer', self.bulk_size * 20)
+        self.bulk_actions = []
+        self.bulk_lock = threading.Lock()
+        self.bulk_pid = None
+        self.bulk_enabled = bool(config.get('bulk'))
 
         cluster = [{**c} for c in config.get('connection') or []]
         log.debug('Establishing connection towards: {}'.format(cluster))
@@ -20,42 +36,148 @@ class Database:
                 Transport,
                 **(config.get('kwargs') or {})
             )
-            self.es.ping()
+            self._ping()
         except ConnectionError as e:
-            err = 'Failed to establish connection to the Elasticsearch cluster, please verify the config: {}'
-            format(str(e))
+            err = 'Failed to establish connection to the Elasticsearch cluster, please verify the config: {}'.format(
+                str(e)
+            )
             log.debug(err)
             raise ConnectionError(err)
 
     def get_connection(self):
+        if time.time() - self.last_health_check < self.health_check_interval:
+            return self.es
+
         try:
-            self.es.ping()
+            self._ping()
 
             return self.es
         except ConnectionError as e:
-            err = 'Could not ping the ElasticSearch cluster, please try again later'
-            format(str(e))
+            err = 'Could not ping the ElasticSearch cluster, please try again later: {}'.format(str(e))
             log.debug(err)
             raise ConnectionError(err)
 
+    def _ping(self):
+        # The client reports an unreachable cluster by returning False, rather than raising
+        if not self.es.ping():
+            raise ConnectionError('Elasticsearch cluster did not respond to ping')
+
+        self.last_health_check = time.time()
+
     def create_document(self, area: str, body: dict, kind: str = '_doc'):
         # Creates a new document(body) of a specified type(optional),
         # within a specific area (index/collection/etc)
+        if self.bulk_enabled:
+            self._buffer_action({'_index': area, '_type': kind, '_source': body})
+            return
+
         con = self.get_connection()
         con.index(area, body, kind)
 
     def fetch_document(self, area: str, body: dict, query_clause='match', **kwargs):
         # Uses Elasticsearch Query DSL:
         # https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl.html
+        # Deep pagination should use `sort` together with `search_after`,
+        # being the sort values of the last hit from the previous page
         con = self.get_connection()
 
-        offset = kwargs.get('start', 0)
         size = kwargs.get('size', 10)
-        search_body = json.dumps({'from': offset, 'size': size, 'query': {query_clause: body}})
+        search = {'size': size, 'query': {query_clause: body}}
 
-        res = con.search(area, body=search_body)
+        if kwargs.get('sort'):
+            search['sort'] = kwargs.get('sort')
+
+        if kwargs.get('search_after'):
+            search['search_after'] = kwargs.get('search_after')
+        else:
+            search['from'] = kwargs.get('start', 0)
+
+        res = con.search(index=area, body=json.dumps(search))
 
         return res.get('hits', {})
 
+    def scroll_documents(self, area: str, body: dict, query_clause='match', size=500, scroll='5m'):
+        # Iterates all documents matching the query, using the scroll API
+        con = self.get_connection()
+
+        yield from helpers.scan(
+            con,
+            index=area,
+            query={'query': {query_clause: body}},
+            size=size,
+            scroll=scroll
+        )
+
+    def flush(self):
+        with self.bulk_lock:
+            actions, self.bulk_actions = self.bulk_actions, []
+
+        if not actions:
+            return
+
+        indexed, retry, sent = 0, [], 0
+        try:
+            results = helpers.streaming_bulk(self.get_connection(), actions, raise_on_error=False)
+
+            # Results are reported in the same order as the actions were sent
+            for action, (ok, item) in zip(actions, results):
+                sent += 1
+                if ok:
+                    indexed += 1
+                    continue
+
+                status = next(iter(item.values()), {}).get('status', 0)
+                if status == RETRYABLE_STATUS or status >= 500:
+                    retry.append(action)
+                else:
+                    log.warning('Dropping document rejected by Elasticsearch ({}): {}'.format(status, item))
+
+        finally:
+            # Actions not sent due to a connection failure are retried together with the rejected ones
+            self._requeue(retry + actions[sent:])
+            log.debug('Indexed {} documents in bulk, {} to retry'.format(indexed, len(retry) + len(actions) - sent))
+
+    def _requeue(self, actions):
+        if not actions:
+            return
+
+        with self.bulk_lock:
+            self.bulk_actions[:0] = actions
+
+            dropped = len(self.bulk_actions) - self.bulk_max_buffer
+            if dropped > 0:
+                log.warning('Bulk buffer is full, dropping {} documents to retry'.format(dropped))
+                del self.bulk_actions[:dropped]
+
+    def close(self):
+        self.flush()
+
     def initialize_database(self):
         pass
+
+    def _buffer_action(self, action):
+        with self.bulk_lock:
+            if self.bulk_pid != os.getpid():
+                # Buffered actions and the flushing thread belongs to the parent process after a fork
+                self.bulk_pid = os.getpid()
+                self.bulk_actions = []
+                threading.Thread(name='Elasticsearch Bulk Buffer', target=self._flush_periodically, daemon=True).start()
+
+            if len(self.bulk_actions) >= self.bulk_max_buffer:
+                raise ConnectionError('Bulk buffer is full, as documents cannot be indexed at this point')
+
+            self.bulk_actions.append(action)
+            full = len(self.bulk_actions) >= self.bulk_size
+
+        if full:
+            self.flush()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.bulk_interval / 1000.0)
+
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning('Failed indexing buffered documents, retrying later: {}'.format(str(e)))
+
@@ -1,13 +1,22 @@
 #! /usr/bin/env python3
+import io
 import logging
 import os
+import threading
 import time
+from contextlib import contextmanager, suppress
 
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+from psycopg2 import sql
 
 DB_TYPE = 'postgres'
 
+# Errors where the rows could still be written later, as opposed to rows rejected by the database
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, psycopg2.pool.PoolError)
+
 log = logging.getLogger(__name__)
 
 
@@ -19,6 +28,24 @@ class Database:
         self.init_script = config.get('init', None)
         db_type = config.get('type', 'UNKNOWN')
 
+        pool_cfg = self.cfg_con.get('pool') or {}
+        self.pool_min = pool_cfg.get('min', 1)
+        self.pool_max = pool_cfg.get('max', 10)
+        self.pool_check_interval = pool_cfg.get('health_check_interval', 30)
+        self.pool_used = dict()
+        self.pool = None
+        self.pool_pid = None
+        self.pool_lock = threading.Lock()
+        self.pool_slots = threading.BoundedSemaphore(self.pool_max)
+        self.inherited_pools = []
+
+        buffer_cfg = config.get('write_buffer') or {}
+        self.buffer_size = buffer_cfg.get('size', 500)
+        self.buffer_interval = buffer_cfg.get('interval', 1000)
+        self.buffer_max_rows = buffer_cfg.get('max_rows', self.buffer_size * 20)
+        self.writers = dict()
+        self.writers_lock = threading.Lock()
+
         if not db_type == DB_TYPE:
             err = 'Attempt to establish connection with a Postgres DB, using {} configuration'.format(db_type)
             log.warning(err)
@@ -47,14 +74,7 @@ class Database:
                 self.cfg_con.get('host', 'localhost'),
                 self.cfg_con.get('port', '5432')
             ))
-            connection = psycopg2.connect(
-                dbname=self.cfg_con.get('name', 'postgres'),
-                port=self.cfg_con.get('port', '5432'),
-                user=self.cfg_con.get('user', 'postgres'),
-                host=self.cfg_con.get('host', 'localhost'),
-                password=self.cfg_con.get('password', 'postgres'),
-                connect_timeout=self.cfg_con.get('timeout', 5)
-            )
+            connection = psycopg2.connect(**self._connection_args())
             connection.autocommit = True
 
             return connection
@@ -66,6 +86,96 @@ class Database:
             log.debug(err)
             raise ConnectionError(err)
 
+    def _connection_args(self):
+        return dict(
+            dbname=self.cfg_con.get('name', 'postgres'),
+            port=self.cfg_con.get('port', '5432'),
+            user=self.cfg_con.get('user', 'postgres'),
+            host=self.cfg_con.get('host', 'localhost'),
+            password=self.cfg_con.get('password', 'postgres'),
+            connect_timeout=self.cfg_con.get('timeout', 5)
+        )
+
+    def _get_pool(self):
+        pid = os.getpid()
+
+        with self.pool_lock:
+            if self.pool_pid != pid:
+                if self.pool:
+                    # Connections inherited through fork belongs to the parent process,
+                    # keeping a reference avoids closing them when garbage collected
+                    self.inherited_pools.append(self.pool)
+                    self.pool_slots = threading.BoundedSemaphore(self.pool_max)
+
+                log.debug('Creating connection pool ({}-{} connections) for process {}'.format(
+                    self.pool_min, self.pool_max, pid
+                ))
+                self.pool = psycopg2.pool.ThreadedConnectionPool(
+                    self.pool_min, self.pool_max, **self._connection_args()
+                )
+                self.pool_pid = pid
+
+            return self.pool
+
+    @contextmanager
+    def _pooled_connection(self):
+        pool = self._get_pool()
+        self.pool_slots.acquire()
+
+        con = None
+        try:
+            con = self._healthy_connection(pool)
+            yield con
+
+        finally:
+            if con:
+                healthy = self._healthy(con)
+                if healthy:
+                    self.pool_used[id(con)] = time.monotonic()
+                else:
+                    self.pool_used.pop(id(con), None)
+
+                pool.putconn(con, close=not healthy)
+            self.pool_slots.release()
+
+    def _healthy_connection(self, pool):
+        con = pool.getconn()
+
+        # Every idle connection may have been dropped at once, eg. when the database restarted
+        for _ in range(self.pool_max):
+            if self._healthy(con) and self._responding(con):
+                break
+
+            log.debug('Replacing unhealthy pooled connection')
+            self.pool_used.pop(id(con), None)
+            pool.putconn(con, close=True)
+            con = pool.getconn()
+
+        con.autocommit = True
+        return con
+
+    def _responding(self, con):
+        # A connection dropped by the server or the network looks healthy until used,
+        # so connections idle for a while are probed before being handed out
+        used = self.pool_used.get(id(con))
+        if used is None or time.monotonic() - used < self.pool_check_interval:
+            return True
+
+        try:
+            con.autocommit = True
+            with con.cursor() as cur:
+                cur.execute('SELECT 1')
+
+            return True
+
+        except psycopg2.Error as e:
+            log.debug('Pooled connection did not respond: {}'.format(str(e)))
+            return False
+
+    @staticmethod
+    def _healthy(con):
+        return not con.closed and con.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+
     def initialize_database(self):
         log.info('Initializing Postgres database')
         try:
@@ -113,8 +223,8 @@ class Database:
         log.debug('Preparing query')
         log.debug(query)
         try:
-            log.debug('Establishing database connection for query execution')
-            with self._create_connection() as con:
+            log.debug('Fetching pooled database connection for query execution')
+            with self._pooled_connection() as con:
                 try:
                     log.debug('Executing query')
                     with con.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
@@ -136,3 +246,214 @@ class Database:
             err = 'Could not connect to local database: {}'.format(str(e))
             log.warning(err)
             raise ConnectionError(err)
+
+    def execute_many(self, query: str, rows: list, template: str = None, page_size: int = 100, fetch: bool = False):
+        """
+        Executes a query for several rows, in as few statements as possible, within a single transaction
+
+        :param query: Query containing a single %s placeholder for the rows,
+                        eg. INSERT INTO items (id, name) VALUES %s
+        :param rows: Sequence of rows, each being a tuple (or dictionary, when using a named template)
+        :param template: Optional template for each row, eg. (%(id)s, %(name)s)
+        :param page_size: Maximum number of rows per statement
+        :param fetch: Return the result of the statements, eg. when using RETURNING
+        :return: Result after execution, if fetched, using psycopg2.extras.execute_values
+        """
+        log.debug('Preparing query for {} rows'.format(len(rows)))
+        log.debug(query)
+        try:
+            return self._execute_values(query, rows, template, page_size, fetch)
+
+        except Exception as e:
+            err = 'Could not execute query {}: {}'.format(query, str(e))
+            log.warning(err)
+            raise ConnectionError(err)
+
+    def _execute_values(self, query: str, rows: list, template: str = None, page_size: int = 100, fetch=False):
+        # Either all rows are written, or none, so failed rows can be written again without duplicates
+        with self._pooled_connection() as con:
+            con.autocommit = False
+            try:
+                with con.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    res = psycopg2.extras.execute_values(
+                        cur, query, rows, template=template, page_size=page_size, fetch=fetch
+                    )
+                con.commit()
+                log.debug('Query executed')
+
+            except Exception:
+                with suppress(psycopg2.Error):
+                    con.rollback()
+                raise
+
+            return [dict(r) for r in res] if fetch else None
+
+    def copy_rows(self, table: str, rows: list, columns: list = None):
+        """
+        Inserts rows into a table using COPY FROM STDIN
+
+        :param table: Name of the table to insert into
+        :param rows: Sequence of rows, each being a tuple of values in the same order as the columns
+        :param columns: Name of the columns to insert into, defaults to all columns of the table
+        :return: Number of rows copied
+        """
+        log.debug('Copying {} rows into {}'.format(len(rows), table))
+        query = sql.SQL('COPY {} {} FROM STDIN').format(
+            sql.Identifier(*table.split('.')),
+            sql.SQL('({})').format(sql.SQL(', ').join(map(sql.Identifier, columns))) if columns else sql.SQL('')
+        )
+
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(_copy_value(v) for v in row))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        try:
+            with self._pooled_connection() as con:
+                with con.cursor() as cur:
+                    cur.copy_expert(query.as_string(con), buffer)
+                    log.debug('Rows copied')
+
+                    return cur.rowcount
+
+        except Exception as e:
+            err = 'Could not copy rows into {}: {}'.format(table, str(e))
+            log.warning(err)
+            raise ConnectionError(err)
+
+    def buffered_writer(self, query: str, template: str = None, size: int = None, interval: int = None):
+        """
+        Gets the write-behind buffer of the query, executing the query for the buffered rows using execute_many.
+        The rows are written when the buffer holds `size` rows, or every `interval` milliseconds.
+
+        Rows rejected by the database are logged and dropped, while rows failing due to the connection
+        are kept in the buffer and written later. Writing fails when the buffer holds `max_rows` rows.
+
+        Each process has a single writer per query and template, created by the first call,
+        so the writer can be requested on every plugin execution.
+        Its flushing thread does not survive a fork, so writers created before forking are not reused.
+        """
+        key = (query, template, os.getpid())
+
+        with self.writers_lock:
+            self.writers = {k: w for k, w in self.writers.items() if not w.closed.is_set()}
+
+            writer = self.writers.get(key)
+            if not writer:
+                writer = self.writers[key] = BufferedWriter(
+                    self, query, template,
+                    size or self.buffer_size,
+                    interval or self.buffer_interval,
+                    max(self.buffer_max_rows, size or 0)
+                )
+
+        return writer
+
+    def close(self):
+        with self.writers_lock:
+            writers, self.writers = self.writers, dict()
+
+        # Rows buffered by the process this one was forked from, are written by that process
+        for (_, _, pid), writer in writers.items():
+            if pid == os.getpid():
+                writer.close()
+
+
+class BufferedWriter:
+    def __init__(self, database: Database, query: str, template: str, size: int, interval: int, max_rows: int):
+        self.database = database
+        self.query = query
+        self.template = template
+        self.size = size
+        self.interval = interval
+        self.max_rows = max_rows
+
+        self.rows = []
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+
+        threading.Thread(name='Postgres Write Buffer', target=self._flush_periodically, daemon=True).start()
+
+    def write(self, *rows):
+        if self.closed.is_set():
+            raise ConnectionError('Could not write to a closed buffer')
+
+        with self.lock:
+            if len(self.rows) + len(rows) > self.max_rows:
+                raise ConnectionError('Write buffer is full, as rows cannot be written to the database at this point')
+
+            self.rows.extend(rows)
+            full = len(self.rows) >= self.size
+
+        if not full:
+            return
+
+        try:
+            self.flush()
+        except ConnectionError as e:
+            # The rows are kept in the buffer, and written once the database is available again
+            log.warning('Failed flushing buffered rows, retrying later: {}'.format(str(e)))
+
+    def flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+
+        if not rows:
+            return
+
+        written, rejected = 0, 0
+        chunks = [rows]
+        while chunks:
+            chunk = chunks.pop()
+            try:
+                self.database._execute_values(self.query, chunk, self.template, page_size=self.size)
+                written += len(chunk)
+
+            except CONNECTION_ERRORS as e:
+                # Chunks are written in order, so the chunk and those left are the rows not yet written
+                self._requeue([row for c in [chunk] + chunks[::-1] for row in c])
+                raise ConnectionError('Could not write buffered rows: {}'.format(str(e)))
+
+            except psycopg2.Error as e:
+                if len(chunk) > 1:
+                    # Halves the chunk until the rows rejected by the database are found
+                    middle = len(chunk) // 2
+                    chunks.extend([chunk[middle:], chunk[:middle]])
+                    continue
+
+                rejected += 1
+                log.warning('Dropping row rejected by the database: {} ({})'.format(chunk[0], str(e).strip()))
+
+        log.debug('Flushed {} buffered rows, {} rejected'.format(written, rejected))
+
+    def close(self):
+        self.closed.set()
+        self.flush()
+
+    def _requeue(self, rows):
+        with self.lock:
+            self.rows[:0] = rows
+
+            dropped = len(self.rows) - self.max_rows
+            if dropped > 0:
+                log.warning('Write buffer is full, dropping {} rows to retry'.format(dropped))
+                del self.rows[:dropped]
+
+    def _flush_periodically(self):
+        while not self.closed.wait(self.interval / 1000.0):
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning('Failed flushing buffered rows, retrying later: {}'.format(str(e)))
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+
+    return str(value) \
+        .replace('\\', '\\\\') \
+        .replace('\t', '\\t') \
+        .replace('\n', '\\n') \
+        .replace('\r', '\\r')
@@ -0,0 +1,100 @@
+from collections import namedtuple
+from concurrent.futures import Future
+from unittest import TestCase
+
+from kafka import TopicPartition
+
+from sqapi.messaging.brokers.kafka import Listener, PartitionLane
+
+PARTITION = TopicPartition('sqapi', 0)
+Record = namedtuple('Record', ['topic', 'partition', 'offset', 'key', 'value'])
+
+
+def record(offset):
+    return Record(PARTITION.topic, PARTITION.partition, offset, None, b'{}')
+
+
+def result(exception=None):
+    future = Future()
+    if exception:
+        future.set_exception(exception)
+    else:
+        future.set_result(None)
+
+    return future
+
+
+class TestPartitionLane(TestCase):
+    def setUp(self):
+        self.lane = PartitionLane(PARTITION)
+        self.lane.queued.extend(record(offset) for offset in range(3))
+
+    def test_should_limit_records_in_flight(self):
+        self.lane.take()
+
+        self.assertFalse(self.lane.ready(1, 0))
+        self.assertTrue(self.lane.ready(2, 0))
+
+    def test_should_commit_contiguous_completions_only(self):
+        first, second = self.lane.take(), self.lane.take()
+
+        self.lane.completed(second)
+        self.assertIsNone(self.lane.pending_commit())
+
+        self.lane.completed(first)
+        self.assertEqual(2, self.lane.pending_commit())
+
+    def test_should_not_commit_past_record_to_retry(self):
+        first, second = self.lane.take(), self.lane.take()
+
+        self.lane.retry(first, 0)
+        self.lane.completed(second)
+        self.assertIsNone(self.lane.pending_commit())
+
+        self.assertEqual(0, self.lane.take().offset)
+        self.assertFalse(self.lane.ready(2, 0))
+
+        self.lane.completed(first)
+        self.assertEqual(2, self.lane.pending_commit())
+        self.assertTrue(self.lane.ready(2, 0))
+
+    def test_should_retry_record_after_interval(self):
+        first = self.lane.take()
+        self.lane.retry(first, 60)
+
+        self.assertFalse(self.lane.ready(1, 0))
+        self.assertEqual(0, self.lane.take().offset)
+
+
+class TestListener(TestCase):
+    def setUp(self):
+        self.listener = Listener({'max_in_flight': 1, 'retry_interval': 0, 'max_retries': 2}, lambda body: body)
+        self.lane = self.listener.lanes[PARTITION] = PartitionLane(PARTITION)
+        self.lane.queued.extend(record(offset) for offset in range(2))
+
+    def test_should_not_commit_records_to_retry(self):
+        first = self.lane.take()
+        self.listener.handle_result(result(LookupError('Metadata not found')), first, self.lane)
+
+        self.assertIsNone(self.lane.pending_commit())
+        self.assertEqual([0, 1], [r.offset for r in self.lane.queued])
+
+    def test_should_commit_failed_records(self):
+        first = self.lane.take()
+        self.listener.handle_result(result(ValueError('Unsupported mime type')), first, self.lane)
+
+        self.assertEqual(1, self.lane.pending_commit())
+
+    def test_should_not_commit_records_interrupted_by_shutdown(self):
+        first = self.lane.take()
+        self.listener.handle_result(result(SystemExit()), first, self.lane)
+
+        self.assertIsNone(self.lane.pending_commit())
+
+    def test_should_commit_records_failing_after_max_retries(self):
+        for _ in range(3):
+            first = self.lane.take()
+            self.listener.handle_result(result(LookupError('Metadata not found')), first, self.lane)
+
+        self.assertEqual(1, self.lane.pending_commit())
+        self.assertEqual(1, self.lane.take().offset)
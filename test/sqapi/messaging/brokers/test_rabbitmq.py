@@ -0,0 +1,99 @@
+from unittest import TestCase, mock
+
+from sqapi.messaging.brokers.rabbitmq import Acknowledger, DeadLetterPublisher
+
+
+class FakeChannel:
+    def __init__(self):
+        self.sent = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.sent.append(('ack', delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, requeue=False):
+        self.sent.append(('nack', delivery_tag, requeue))
+
+
+class FakeConnection:
+    attempts = 0
+    published = []
+
+    def __init__(self, parameters):
+        FakeConnection.attempts += 1
+        if FakeConnection.attempts == 1:
+            raise ConnectionError('Broker unavailable')
+
+        self.is_open = True
+        self.uncommitted = []
+
+    def channel(self):
+        return self
+
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def tx_select(self):
+        pass
+
+    def basic_publish(self, exchange, routing_key, properties, body):
+        self.uncommitted.append((exchange, routing_key, body))
+
+    def tx_commit(self):
+        FakeConnection.published.extend(self.uncommitted)
+        self.uncommitted = []
+
+    def process_data_events(self, time_limit):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class TestDeadLetterPublisher(TestCase):
+    @mock.patch('pika.BlockingConnection', FakeConnection)
+    def test_should_publish_buffered_messages_after_reconnecting(self):
+        publisher = DeadLetterPublisher('localhost', 5672, 'DLQ', 'topic', {'batch_size': 2}, retry_interval=0.01)
+
+        for i in range(3):
+            publisher.publish('message.sqapi.plugin', None, str(i).encode('utf-8'))
+        publisher.start()
+        publisher.close()
+
+        self.assertEqual(2, FakeConnection.attempts)
+        self.assertEqual([('DLQ', 'message.sqapi.plugin', str(i).encode('utf-8')) for i in range(3)],
+                         FakeConnection.published)
+
+
+class TestAcknowledger(TestCase):
+    def setUp(self):
+        self.channel = FakeChannel()
+        self.acknowledger = Acknowledger(self.channel)
+
+        for tag in range(1, 6):
+            self.acknowledger.received(tag)
+
+    def test_should_acknowledge_consecutive_deliveries_at_once(self):
+        for tag in [3, 2, 1]:
+            self.acknowledger.completed(tag)
+        self.acknowledger.send()
+
+        self.assertEqual([('ack', 3, True)], self.channel.sent)
+
+    def test_should_acknowledge_deliveries_completed_ahead_individually(self):
+        self.acknowledger.completed(2)
+        self.acknowledger.send()
+
+        self.acknowledger.completed(1)
+        self.acknowledger.completed(3)
+        self.acknowledger.send()
+
+        self.assertEqual([('ack', 2, False), ('ack', 3, True)], self.channel.sent)
+
+    def test_should_nack_failures_between_acknowledgements(self):
+        self.acknowledger.completed(1)
+        self.acknowledger.completed(2, ack=False, requeue=True)
+        self.acknowledger.completed(3)
+        self.acknowledger.completed(5)
+        self.acknowledger.send()
+
+        self.assertEqual([('ack', 1, True), ('nack', 2, True), ('ack', 3, True), ('ack', 5, False)], self.channel.sent)
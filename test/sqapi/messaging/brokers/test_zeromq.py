@@ -0,0 +1,55 @@
+import threading
+from unittest import TestCase
+
+import zmq
+
+from sqapi.messaging.brokers.zeromq import Listener
+
+
+class TestListener(TestCase):
+    def setUp(self):
+        self.received = []
+        self.lock = threading.Lock()
+
+    def _process(self, body):
+        if bytes(body) == b'bad':
+            raise ValueError('Unsupported message')
+
+        with self.lock:
+            self.received.append((type(body), bytes(body)))
+
+    def _start(self, name, **config):
+        listener = Listener(dict(config, protocol='inproc', host=name, port=0, connection_type='bind'), self._process)
+        threading.Thread(target=listener.start_listener, daemon=True).start()
+
+        return listener
+
+    def test_should_reply_with_result_of_each_message(self):
+        listener = self._start('reply', reply=True, workers=2)
+
+        client = listener.context.socket(zmq.REQ)
+        client.connect('inproc://reply:0')
+
+        replies = []
+        for body in [b'good', b'bad']:
+            client.send(body)
+            replies.append(client.recv())
+
+        self.assertEqual([b'ACK', b'NACK Unsupported message'], replies)
+        self.assertEqual([(memoryview, b'good')], self.received)
+
+    def test_should_distribute_messages_to_workers(self):
+        listener = self._start('fanout', workers=3, rcvhwm=10, max_in_flight=3)
+
+        client = listener.context.socket(zmq.PUSH)
+        client.connect('inproc://fanout:0')
+        for i in range(6):
+            client.send(str(i).encode('utf-8'))
+
+        for _ in range(100):
+            with self.lock:
+                if len(self.received) == 6:
+                    break
+            threading.Event().wait(0.02)
+
+        self.assertEqual({str(i).encode('utf-8') for i in range(6)}, {body for _, body in self.received})
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+from unittest import TestCase
+
+from sqapi.messaging.dispatcher import Dispatcher
+
+
+class TestDispatcher(TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_seen = 0
+
+    def _process(self, body, *args):
+        with self.lock:
+            self.in_flight += 1
+            self.max_seen = max(self.max_seen, self.in_flight)
+
+        time.sleep(body)
+
+        with self.lock:
+            self.in_flight -= 1
+
+        return body
+
+    def test_should_not_exceed_max_in_flight(self):
+        dispatcher = Dispatcher({'max_in_flight': 2}, self._process)
+
+        futures = [dispatcher.submit(0.02) for _ in range(8)]
+        [f.result() for f in futures]
+
+        self.assertEqual(2, self.max_seen)
+
+    def test_should_pass_arguments_to_callback(self):
+        received = []
+        dispatcher = Dispatcher({'max_in_flight': 1}, lambda body, plugin: received.append((body, plugin)))
+
+        dispatcher.submit(b'body', 'my_plugin').result()
+
+        self.assertEqual([(b'body', 'my_plugin')], received)
+
+    def test_should_refuse_messages_after_shutdown(self):
+        def shutdown(body):
+            raise SystemExit()
+
+        dispatcher = Dispatcher({'max_in_flight': 1}, shutdown)
+        dispatcher.submit(b'body')
+        dispatcher.executor.shutdown(wait=True)
+
+        with self.assertRaises(SystemExit):
+            dispatcher.submit(b'body')
+
+    def test_should_dispatch_full_batches(self):
+        batches = []
+        completed = []
+
+        def process_batch(items):
+            batches.append(items)
+            return [None if body != b'bad' else ValueError(body) for body, _ in items]
+
+        dispatcher = Dispatcher({'batch': {'size': 2, 'interval': 10000}}, self._process, batch_callback=process_batch)
+
+        for body in [b'first', b'bad', b'third']:
+            dispatcher.submit(body, 'plugin', on_done=lambda f: completed.append(repr(f.exception())))
+        dispatcher.flush()
+        dispatcher.executor.shutdown(wait=True)
+
+        self.assertEqual([[(b'first', 'plugin'), (b'bad', 'plugin')], [(b'third', 'plugin')]], batches)
+        self.assertEqual(['None', "ValueError(b'bad')", 'None'], completed)
+
+    def test_should_dispatch_partial_batch_after_interval(self):
+        dispatcher = Dispatcher({'batch': {'size': 10, 'interval': 10}}, self._process,
+                                batch_callback=lambda items: [body for body, in items])
+
+        future = dispatcher.submit(b'body')
+
+        self.assertEqual(b'body', future.result(timeout=1))
+
+    def test_should_run_coroutines_concurrently(self):
+        async def process(body):
+            await asyncio.sleep(0.1)
+            return body
+
+        dispatcher = Dispatcher({'max_in_flight': 10}, process)
+
+        start = time.time()
+        futures = [dispatcher.submit(i) for i in range(10)]
+
+        self.assertEqual(list(range(10)), [f.result(timeout=1) for f in futures])
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_should_pass_system_exit_from_coroutine(self):
+        async def shutdown(body):
+            raise SystemExit()
+
+        dispatcher = Dispatcher({'max_in_flight': 1}, shutdown)
+
+        self.assertIsInstance(dispatcher.submit(b'body').exception(timeout=1), SystemExit)
+        self.assertTrue(dispatcher.loop.is_running())
+
+    def test_should_keep_receiving_while_messages_are_delayed(self):
+        dispatcher = Dispatcher({'max_in_flight': 1, 'process_delay': 0.2}, self._process)
+
+        start = time.time()
+        futures = [dispatcher.submit(0) for _ in range(5)]
+        submitted = time.time() - start
+
+        [f.result(timeout=1) for f in futures]
+
+        self.assertLess(submitted, 0.1)
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_should_count_delay_from_received_time(self):
+        dispatcher = Dispatcher({'process_delay': 60}, self._process)
+
+        future = dispatcher.submit(0, received=time.monotonic() - 60)
+
+        self.assertEqual(0, future.result(timeout=1))
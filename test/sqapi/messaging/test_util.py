@@ -4,6 +4,7 @@ import uuid
 from unittest import TestCase
 
 from sqapi.messaging import util
+from sqapi.messaging.message import MessageSchema
 
 config = dict({
     # String parsing specific config
@@ -90,5 +91,39 @@ class TestParseMessage(TestCase):
             # Verify
             self.assertTrue(isinstance(e, NotImplementedError))
 
+    def test_should_not_modify_config_when_compiling_schema(self):
+        # Setup
+        fields = {'data_location': {'key': 'hash'}}
+
+        # Execute
+        schema = MessageSchema({'parser': {'type': 'json'}, 'fields': fields})
+
+        # Verify
+        self.assertEqual({'data_location': {'key': 'hash'}}, fields)
+        self.assertEqual(frozenset({'hash'}), schema.required)
+
+    def test_should_reject_missing_required_fields(self):
+        # Setup
+        schema = MessageSchema({'parser': {'type': 'json'}, 'fields': config.get('fields')})
+
+        # Execute
+        try:
+            util.parse_message(json.dumps({'uuid': self.msg_uuid}).encode('UTF-8'), schema)
+            self.fail("Should have thrown exception due missing required field")
+        except AttributeError as e:
+            # Verify
+            self.assertIn('hash', str(e))
+
+    def test_should_parse_json_from_frame_buffer(self):
+        # Setup
+        schema = MessageSchema({'parser': {'type': 'json'}, 'fields': config.get('fields')})
+
+        # Execute
+        result = util.parse_message(memoryview(self.json_bytes), schema)
+
+        # Verify
+        self.assertEqual(self.msg_uuid, result.uuid)
+        self.assertEqual(self.msg_hash, result.data_location)
+
     def tearDown(self):
         pass
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+from unittest import TestCase
+
+from sqapi.configuration import fileinfo
+from sqapi.plugin.router import MimeRouter
+
+
+def plugin(name, mime_types):
+    return SimpleNamespace(name=name, config=SimpleNamespace(plugin={'mime_types': mime_types}))
+
+
+class TestMimeRouter(TestCase):
+    def setUp(self):
+        self.jpeg = plugin('jpeg', ['image/jpeg'])
+        self.images = plugin('images', ['image/*', 'application/pdf'])
+        self.text = plugin('text', ['text/plain'])
+
+    def test_should_route_exact_and_major_types_in_registration_order(self):
+        router = MimeRouter([self.images, self.jpeg, self.text])
+
+        self.assertEqual((self.images, self.jpeg), router.route('image/jpeg'))
+        self.assertEqual((self.images,), router.route('image/png'))
+        self.assertEqual((self.images,), router.route('application/pdf'))
+        self.assertEqual((self.text,), router.route('text/plain'))
+        self.assertEqual((), router.route('video/mp4'))
+
+    def test_should_route_everything_to_plugins_without_mime_types(self):
+        everything = plugin('everything', None)
+        router = MimeRouter([self.jpeg, everything])
+
+        self.assertEqual((self.jpeg, everything), router.route('image/jpeg'))
+        self.assertEqual((everything,), router.route('video/mp4'))
+
+    def test_should_validate_mime_types(self):
+        router = MimeRouter([self.images, self.text])
+
+        fileinfo.validate_mime_type('image/gif', router)
+        fileinfo.validate_mime_type('text/plain', router)
+
+        with self.assertRaises(NotImplementedError):
+            fileinfo.validate_mime_type('text/html', router)
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from sqapi.processing import dedup
+
+
+class TestDiskDedupCache(TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp('.db')
+        os.close(fd)
+
+        self.cache = dedup.create_cache({'type': 'disk', 'path': self.path, 'ttl': 60, 'max_entries': 2})
+
+    def test_should_remember_processed_content_per_plugin_version(self):
+        self.cache.record('thumbnails', '1', 'abc')
+
+        self.assertTrue(self.cache.processed('thumbnails', '1', 'abc'))
+        self.assertFalse(self.cache.processed('thumbnails', '2', 'abc'))
+        self.assertFalse(self.cache.processed('duplicates', '1', 'abc'))
+        self.assertFalse(self.cache.processed('thumbnails', '1', 'def'))
+
+    def test_should_forget_expired_content(self):
+        self.cache.ttl = 0.01
+        self.cache.record('thumbnails', None, 'abc')
+        time.sleep(0.02)
+
+        self.assertFalse(self.cache.processed('thumbnails', None, 'abc'))
+
+    def test_should_evict_least_recently_seen(self):
+        for digest in ['a', 'b', 'c']:
+            self.cache.record('thumbnails', '1', digest)
+        self.cache.processed('thumbnails', '1', 'a')
+
+        self.cache.evict()
+
+        self.assertTrue(self.cache.processed('thumbnails', '1', 'a'))
+        self.assertFalse(self.cache.processed('thumbnails', '1', 'b'))
+        self.assertTrue(self.cache.processed('thumbnails', '1', 'c'))
+
+    def test_should_be_disabled_without_type(self):
+        self.assertIsNone(dedup.create_cache({}))
+
+    def tearDown(self):
+        os.remove(self.path)
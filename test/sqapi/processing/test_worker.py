@@ -0,0 +1,136 @@
+import os
+import signal
+import tempfile
+import time
+from collections import namedtuple
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+from sqapi.processing.worker import PluginWorkerPool, plugin_batch_execution, serialize
+
+Message = namedtuple('Message', ['uuid', 'body'])
+
+
+def execute(config, database, message, metadata, open_file):
+    if message.body == 'crash':
+        os._exit(1)
+
+    elif message.body == 'sleep':
+        time.sleep(5)
+
+    elif message.body == 'exit':
+        raise SystemExit()
+
+    elif message.body == 'hang':
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+        time.sleep(5)
+
+
+def create_plugin(timeout=10):
+    return SimpleNamespace(
+        name='test_plugin', execute=execute, database=None, accepts_content=False,
+        config=SimpleNamespace(plugin={'timeout': timeout})
+    )
+
+
+class TestPluginWorkerPool(TestCase):
+    def setUp(self):
+        self.data = tempfile.NamedTemporaryFile()
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool:
+            self.pool.close()
+        self.data.close()
+
+    def _start(self, size=1, timeout=10):
+        self.pool = PluginWorkerPool(create_plugin(timeout), size)
+        self.pool.start()
+
+        return self.pool
+
+    def _submit(self, body):
+        return self.pool.submit(serialize(Message('uuid', body), {}), self.data.name)
+
+    def test_should_report_success_as_no_failure(self):
+        self._start()
+
+        self.assertIsNone(self._submit('ok').future.result(timeout=5))
+
+    def test_should_fail_and_replace_crashed_worker(self):
+        self._start()
+
+        failure = self._submit('crash').future.result(timeout=5)
+
+        self.assertEqual(ChildProcessError, failure.exception_type)
+        self.assertIsNone(self._submit('ok').future.result(timeout=5))
+
+    def test_should_replace_crashed_worker_while_others_report_results(self):
+        self._start(size=2)
+
+        crashed = self._submit('crash')
+        deadline = time.time() + 5
+        while not crashed.future.done() and time.time() < deadline:
+            self._submit('ok').future.result(timeout=5)
+
+        self.assertEqual(ChildProcessError, crashed.future.result(timeout=0).exception_type)
+
+    def test_should_fail_execution_exceeding_timeout(self):
+        self._start(timeout=1)
+
+        failure = self._submit('sleep').future.result(timeout=5)
+
+        self.assertEqual(TimeoutError, failure.exception_type)
+
+    @mock.patch('sqapi.processing.worker.TIMEOUT_GRACE', 0)
+    def test_should_fail_and_replace_worker_not_reporting_within_timeout(self):
+        self._start(timeout=1)
+
+        failure = self._submit('hang').future.result(timeout=5)
+
+        self.assertEqual(TimeoutError, failure.exception_type)
+        self.assertIsNone(self._submit('ok').future.result(timeout=5))
+
+    def test_should_complete_executions_after_idle_worker_is_killed(self):
+        pool = self._start(size=2)
+
+        os.kill(pool.workers[0].pid, signal.SIGKILL)
+        pool.workers[0].join(timeout=5)
+
+        for _ in range(4):
+            self.assertIsNone(self._submit('ok').future.result(timeout=5))
+
+    def test_should_fail_plugin_exiting_without_stopping_worker(self):
+        self._start()
+
+        failure = self._submit('exit').future.result(timeout=5)
+
+        self.assertEqual(SystemExit, failure.exception_type)
+        self.assertIsNone(self._submit('ok').future.result(timeout=5))
+
+    def test_should_not_replace_workers_when_closing(self):
+        pool = self._start(size=2)
+        workers = list(pool.workers)
+
+        pool.close()
+
+        self.assertFalse(pool.collector.is_alive())
+        self.assertEqual(workers, pool.workers)
+        self.assertFalse(any(worker.is_alive() for worker in pool.workers))
+        self.assertTrue(all(worker.exitcode == 0 for worker in pool.workers))
+
+
+class TestPluginBatchExecution(TestCase):
+    def test_should_fail_batch_reporting_fewer_results_than_messages(self):
+        data = tempfile.NamedTemporaryFile()
+        self.addCleanup(data.close)
+
+        plugin = create_plugin()
+        plugin.accepts_contents = False
+        plugin.execute_batch = lambda config, database, batch: [None]
+
+        payload = serialize(Message('uuid', 'ok'), {})
+        failures = plugin_batch_execution(plugin, [(payload, data.name), (payload, data.name)])
+
+        self.assertEqual(2, len(failures))
+        self.assertTrue(all(failure.exception_type == ValueError for failure in failures))
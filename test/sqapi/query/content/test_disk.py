@@ -0,0 +1,103 @@
+import hashlib
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+from sqapi.query.content import disk
+
+CONTENT = b'0123456789' * 10000
+
+
+def config(mode=None):
+    return SimpleNamespace(data_store={'type': 'disk', 'mode': mode} if mode else {'type': 'disk'})
+
+
+class TestDisk(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, 'file.txt')
+
+        with open(self.source, 'wb') as f:
+            f.write(CONTENT)
+
+        self.stat = os.stat(self.source)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _download(self, mode):
+        download = disk.download_to_disk(config(mode), self.source)
+        if download.temporary:
+            self.addCleanup(os.remove, download.path)
+
+        return download
+
+    def assertDownloaded(self, download):
+        with open(download.path, 'rb') as f:
+            self.assertEqual(CONTENT, f.read())
+
+        self.assertEqual(hashlib.sha256(CONTENT).hexdigest(), download.hash_digest)
+        self.assertEqual(CONTENT[:len(download.header)], download.header)
+        self.assertTrue(download.header)
+
+    def assertUntouched(self):
+        with open(self.source, 'rb') as f:
+            self.assertEqual(CONTENT, f.read())
+
+        self.assertEqual(self.stat.st_mtime_ns, os.stat(self.source).st_mtime_ns)
+
+    def test_should_copy_by_default(self):
+        download = self._download(None)
+
+        self.assertDownloaded(download)
+        self.assertUntouched()
+        self.assertTrue(download.temporary)
+        self.assertNotEqual(self.source, download.path)
+        self.assertTrue(download.path.endswith('.txt'))
+        self.assertNotEqual(self.stat.st_ino, os.stat(download.path).st_ino)
+
+    def test_should_link_to_source(self):
+        download = self._download('link')
+
+        self.assertDownloaded(download)
+        self.assertUntouched()
+        self.assertTrue(download.temporary)
+        self.assertNotEqual(self.source, download.path)
+        self.assertEqual(self.stat.st_ino, os.stat(download.path).st_ino)
+
+    def test_should_copy_when_link_fails(self):
+        with mock.patch('os.link', side_effect=OSError('Invalid cross-device link')):
+            download = self._download('link')
+
+        self.assertDownloaded(download)
+        self.assertUntouched()
+        self.assertTrue(download.temporary)
+        self.assertNotEqual(self.stat.st_ino, os.stat(download.path).st_ino)
+
+    def test_should_refer_to_source(self):
+        download = self._download('reference')
+
+        self.assertDownloaded(download)
+        self.assertUntouched()
+        self.assertFalse(download.temporary)
+        self.assertEqual(self.source, download.path)
+
+    def test_should_fail_missing_file_in_every_mode(self):
+        missing = os.path.join(self.directory.name, 'missing.txt')
+
+        for mode in [None, 'link', 'reference']:
+            with self.assertRaises(FileNotFoundError):
+                disk.download_to_disk(config(mode), missing)
+
+    def test_should_fetch_header(self):
+        self.assertEqual(CONTENT[:16], disk.fetch_header(config(), self.source, 16))
+
+    def test_should_change_version_when_file_changes(self):
+        version = disk.fetch_version(config(), self.source)
+        self.assertEqual(version, disk.fetch_version(config(), self.source))
+
+        with open(self.source, 'ab') as f:
+            f.write(b'appended')
+
+        self.assertNotEqual(version, disk.fetch_version(config(), self.source))
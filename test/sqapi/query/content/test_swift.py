@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+from unittest import TestCase
+
+from sqapi.query.content import swift
+
+OBJECTS = {
+    '/v1/AUTH_test/first/docs/other.txt': b'other',
+    '/v1/AUTH_test/second/docs/file.txt': b'0123456789' * 1000,
+}
+
+
+class FakeSwiftHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        FakeSwiftHandler.requests.append(self.path)
+
+        if self.path.startswith('/auth/v1.0'):
+            self.send_response(200)
+            self.send_header('X-Storage-Url', 'http://{}:{}/v1/AUTH_test'.format(*self.server.server_address))
+            self.send_header('X-Auth-Token', 'token')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        elif self.path.startswith('/v1/AUTH_test?'):
+            body = b'[]' if 'marker=second' in self.path else json.dumps([
+                {'name': 'first', 'count': 1, 'bytes': 5},
+                {'name': 'second', 'count': 1, 'bytes': 10000},
+            ]).encode('utf-8')
+            self._respond(200, body, 'application/json')
+
+        elif self.path in OBJECTS and self.headers.get('Range'):
+            start, end = self.headers.get('Range').split('=')[1].split('-')
+            self._respond(206, OBJECTS[self.path][int(start):int(end) + 1], 'application/octet-stream')
+
+        elif self.path in OBJECTS:
+            self._respond(200, OBJECTS[self.path], 'application/octet-stream')
+
+        else:
+            self._respond(404, b'Not Found', 'text/plain')
+
+    def _respond(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownloadToDisk(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), FakeSwiftHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.config = SimpleNamespace(data_store={
+            'auth_url': 'http://127.0.0.1:{}/auth/v1.0'.format(self.server.server_address[1]),
+            'access_key_id': 'test:tester',
+            'secret_access_key': 'testing',
+            'chunk_size': 1024,
+            'retries': 0,
+        })
+
+        FakeSwiftHandler.requests.clear()
+        swift.connections.__dict__.clear()
+        swift.container_cache.clear()
+
+    def test_should_stream_object_to_disk(self):
+        content = OBJECTS['/v1/AUTH_test/second/docs/file.txt']
+
+        download = swift.download_to_disk(self.config, 'docs/file.txt')
+
+        with open(download.path, 'rb') as f:
+            self.assertEqual(content, f.read())
+        self.assertTrue(download.path.endswith('.txt'))
+        self.assertEqual(hashlib.sha256(content).hexdigest(), download.hash_digest)
+        self.assertEqual(content[:261], download.header)
+        os.remove(download.path)
+
+    def test_should_authenticate_once_and_remember_container(self):
+        for _ in range(3):
+            os.remove(swift.download_to_disk(self.config, 'docs/file.txt').path)
+
+        auth_requests = [r for r in FakeSwiftHandler.requests if r.startswith('/auth')]
+        first_container_requests = [r for r in FakeSwiftHandler.requests if r.startswith('/v1/AUTH_test/first')]
+        account_requests = [r for r in FakeSwiftHandler.requests if r.startswith('/v1/AUTH_test?')]
+
+        self.assertEqual(1, len(auth_requests))
+        self.assertEqual(1, len(first_container_requests))
+        self.assertEqual(2, len(account_requests))
+        self.assertEqual('second', swift.container_cache.get('docs'))
+
+    def test_should_fetch_header_only(self):
+        header = swift.fetch_header(self.config, 'docs/file.txt', 261)
+
+        self.assertEqual(OBJECTS['/v1/AUTH_test/second/docs/file.txt'][:261], header)
+
+    def test_should_only_search_configured_containers(self):
+        self.config.data_store['containers'] = ['first']
+
+        with self.assertRaises(FileNotFoundError):
+            swift.download_to_disk(self.config, 'docs/file.txt')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
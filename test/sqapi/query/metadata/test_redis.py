@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+from sqapi.query import meta
+from sqapi.query.metadata import redis
+
+CONFIG = SimpleNamespace(meta_store={'type': 'redis', 'host': 'localhost', 'port': 6379})
+
+
+class FakeRedis:
+    store = {'first': b'{"id": 1}', 'third': b'{"id": 3}'}
+
+    def __init__(self, connection_pool):
+        self.connection_pool = connection_pool
+
+    def mget(self, keys):
+        return [self.store.get(key) for key in keys]
+
+
+class TestRedis(TestCase):
+    def setUp(self):
+        for patcher in [
+            mock.patch.object(redis, 'pool', None),
+            mock.patch('redis.ConnectionPool'),
+            mock.patch('redis.Redis', FakeRedis),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_should_reuse_connection_pool(self):
+        first = redis._get_client(CONFIG)
+        second = redis._get_client(CONFIG)
+
+        self.assertIs(first.connection_pool, second.connection_pool)
+        redis.redis.ConnectionPool.assert_called_once()
+
+    def test_should_keep_message_order_when_metadata_is_missing(self):
+        messages = [SimpleNamespace(meta_location=ref) for ref in ['third', 'second', 'first']]
+
+        with mock.patch('sqapi.configuration.detector.detect_metadata_connectors', return_value=redis):
+            results = meta.fetch_metadata_many(CONFIG, messages)
+
+        self.assertEqual({'id': 3}, results[0])
+        self.assertIsInstance(results[1], LookupError)
+        self.assertEqual({'id': 1}, results[2])
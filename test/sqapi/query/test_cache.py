@@ -0,0 +1,91 @@
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from sqapi.query import stream
+from sqapi.query.cache import ContentCache
+
+
+class TestContentCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ContentCache({'path': self.directory.name, 'max_size': 45})
+        self.downloads = []
+
+    def download(self, content):
+        def _download():
+            self.downloads.append(content)
+            return stream.write_to_disk([content], '.txt')
+
+        return _download
+
+    def test_should_download_once_per_location_and_version(self):
+        first = self.cache.fetch('docs/file.txt', '1', self.download(b'first'))
+        second = self.cache.fetch('docs/file.txt', '1', self.download(b'first'))
+
+        self.assertEqual([b'first'], self.downloads)
+        self.assertNotEqual(first.path, second.path)
+        self.assertEqual(first.hash_digest, second.hash_digest)
+        self.assertEqual(b'first', second.header)
+        self.assertTrue(second.temporary)
+
+        with open(second.path, 'rb') as f:
+            self.assertEqual(b'first', f.read())
+
+        os.remove(first.path)
+        os.remove(second.path)
+
+    def test_should_download_changed_version(self):
+        os.remove(self.cache.fetch('docs/file.txt', '1', self.download(b'first')).path)
+        os.remove(self.cache.fetch('docs/file.txt', '2', self.download(b'second')).path)
+
+        self.assertEqual([b'first', b'second'], self.downloads)
+
+    def test_should_evict_least_recently_used(self):
+        for location in ['a.txt', 'b.txt', 'a.txt', 'c.txt', 'a.txt', 'b.txt']:
+            os.remove(self.cache.fetch(location, '1', self.download(location.encode('utf-8') * 4)).path)
+
+        self.assertEqual([b'a.txta.txta.txta.txt', b'b.txtb.txtb.txtb.txt', b'c.txtc.txtc.txtc.txt',
+                          b'b.txtb.txtb.txtb.txt'], self.downloads)
+
+    def test_should_share_download_between_concurrent_fetches(self):
+        started, release = threading.Event(), threading.Event()
+
+        def blocking_download():
+            started.set()
+            release.wait(5)
+            return self.download(b'first')()
+
+        with ThreadPoolExecutor(2) as executor:
+            first = executor.submit(self.cache.fetch, 'docs/file.txt', '1', blocking_download)
+            started.wait(5)
+            second = executor.submit(self.cache.fetch, 'docs/file.txt', '1', blocking_download)
+            release.set()
+
+            paths = [first.result(timeout=5).path, second.result(timeout=5).path]
+
+        self.assertEqual([b'first'], self.downloads)
+        for path in paths:
+            os.remove(path)
+
+    def test_should_not_hold_back_fetches_of_other_locations(self):
+        release = threading.Event()
+        key = self.cache._key('docs/file.txt', '1')
+        other = next(f'docs/{i}.txt' for i in range(10000) if self.cache._key(f'docs/{i}.txt', '1')[:2] == key[:2])
+
+        def blocking_download():
+            release.wait(5)
+            return self.download(b'first')()
+
+        with ThreadPoolExecutor(1) as executor:
+            blocked = executor.submit(self.cache.fetch, 'docs/file.txt', '1', blocking_download)
+            os.remove(self.cache.fetch(other, '1', self.download(b'other')).path)
+
+            self.assertFalse(blocked.done())
+            release.set()
+            os.remove(blocked.result(timeout=5).path)
+
+    def tearDown(self):
+        self.directory.cleanup()
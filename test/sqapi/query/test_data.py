@@ -0,0 +1,33 @@
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+from sqapi.query import data
+from sqapi.query.content import disk
+
+
+class TestFetchHeader(TestCase):
+    def setUp(self):
+        self.file = tempfile.NamedTemporaryFile()
+        self.file.write(b'leading bytes')
+        self.file.flush()
+        self.message = SimpleNamespace(data_location=self.file.name)
+
+    def tearDown(self):
+        self.file.close()
+
+    def test_should_sniff_local_connectors_by_default(self):
+        config = SimpleNamespace(data_store={'type': 'disk'})
+
+        with mock.patch('sqapi.configuration.detector.detect_data_connectors', return_value=disk):
+            self.assertEqual(b'leading', data.fetch_header(config, self.message, 7))
+
+    def test_should_not_sniff_remote_connectors_unless_enabled(self):
+        remote = SimpleNamespace(fetch_header=mock.Mock(return_value=b'leading'))
+
+        with mock.patch('sqapi.configuration.detector.detect_data_connectors', return_value=remote):
+            self.assertIsNone(data.fetch_header(SimpleNamespace(data_store={'type': 'swift'}), self.message, 7))
+            remote.fetch_header.assert_not_called()
+
+            config = SimpleNamespace(data_store={'type': 'swift', 'sniff_header': True})
+            self.assertEqual(b'leading', data.fetch_header(config, self.message, 7))
@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+from sqapi.query import meta
+
+CONFIG = SimpleNamespace(meta_store={'type': 'redis'})
+
+
+def message(meta_location):
+    return SimpleNamespace(meta_location=meta_location)
+
+
+class TestFetchMetadataMany(TestCase):
+    def setUp(self):
+        self.store = SimpleNamespace(fetch_metadata_many=mock.Mock())
+
+        patcher = mock.patch('sqapi.configuration.detector.detect_metadata_connectors', return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_should_report_errors_in_the_slot_of_each_message(self):
+        self.store.fetch_metadata_many.return_value = [b'{"id": 1}', None, b'{malformed']
+
+        results = meta.fetch_metadata_many(CONFIG, [message('a'), message(None), message('b'), message('c')])
+
+        self.assertEqual({'id': 1}, results[0])
+        self.assertIsInstance(results[1], AttributeError)
+        self.assertIsInstance(results[2], LookupError)
+        self.assertIsInstance(results[3], ValueError)
+
+    def test_should_only_request_messages_with_a_location(self):
+        self.store.fetch_metadata_many.return_value = [b'{}']
+
+        meta.fetch_metadata_many(CONFIG, [message(None), message('a'), message('')])
+
+        self.store.fetch_metadata_many.assert_called_once_with(CONFIG, ['a'])
+
+    def test_should_fetch_one_at_a_time_without_bulk_support(self):
+        store = SimpleNamespace(fetch_metadata=mock.Mock(side_effect=[b'{"id": 1}', b'{malformed']))
+
+        with mock.patch('sqapi.configuration.detector.detect_metadata_connectors', return_value=store):
+            results = meta.fetch_metadata_many(CONFIG, [message('a'), message('b')])
+
+        self.assertEqual({'id': 1}, results[0])
+        self.assertIsInstance(results[1], ValueError)
@@ -0,0 +1,32 @@
+import os
+import threading
+from unittest import TestCase
+
+from sqapi.query import stream
+
+
+class TestWriteToDisk(TestCase):
+    def test_should_hash_and_capture_header(self):
+        download = stream.write_to_disk([b'a' * 200, b'b' * 200], '.txt')
+
+        self.assertEqual(b'a' * 200 + b'b' * 61, download.header)
+        self.assertTrue(download.temporary)
+        os.remove(download.path)
+
+    def test_should_remove_file_when_cancelled(self):
+        cancelled = threading.Event()
+        written = []
+
+        def chunks():
+            for i in range(10):
+                if i == 2:
+                    cancelled.set()
+                written.append(i)
+                yield b'chunk'
+
+        with self.assertRaises(stream.DownloadCancelled):
+            with stream.cancellable(cancelled):
+                stream.write_to_disk(chunks())
+
+        self.assertEqual([0, 1, 2], written)
+        self.assertIsNone(stream.local.cancelled)
@@ -0,0 +1,70 @@
+import json
+import os
+import time
+from unittest import TestCase, mock
+
+from elasticsearch.serializer import JSONSerializer
+
+from sqapi.storage.elasticsearch import Database
+
+
+def bulk_response(statuses):
+    items = [{'index': {'status': status, 'error': None if status < 300 else 'rejected'}} for status in statuses]
+
+    return {'errors': any(status >= 300 for status in statuses), 'items': items}
+
+
+class TestDatabase(TestCase):
+    def setUp(self):
+        patcher = mock.patch('sqapi.storage.elasticsearch.Elasticsearch')
+        self.es = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+        self.es.ping.return_value = True
+        self.es.transport.serializer = JSONSerializer()
+        self.db = Database({'health_check_interval': 30, 'bulk': {'size': 100, 'max_buffer': 4}})
+
+    def _buffer(self, count):
+        self.db.bulk_actions = [{'_index': 'sqapi', '_type': '_doc', '_source': {'id': i}} for i in range(count)]
+
+    def test_should_retry_only_documents_rejected_due_to_load(self):
+        self._buffer(3)
+        self.es.bulk.return_value = bulk_response([201, 400, 429])
+
+        self.db.flush()
+
+        self.assertEqual([{'id': 2}], [action['_source'] for action in self.db.bulk_actions])
+
+    def test_should_retry_documents_not_sent_when_connection_fails(self):
+        self._buffer(3)
+        self.es.bulk.side_effect = ConnectionError('Cluster unavailable')
+
+        with self.assertRaises(ConnectionError):
+            self.db.flush()
+
+        self.assertEqual(3, len(self.db.bulk_actions))
+
+    def test_should_refuse_documents_when_buffer_is_full(self):
+        self._buffer(4)
+        self.db.bulk_pid = os.getpid()
+
+        with self.assertRaises(ConnectionError):
+            self.db.create_document('sqapi', {'id': 4})
+
+    def test_should_raise_when_ping_fails_after_interval(self):
+        self.es.ping.return_value = False
+
+        self.assertIs(self.es, self.db.get_connection())
+
+        self.db.last_health_check = time.time() - 31
+        with self.assertRaises(ConnectionError):
+            self.db.get_connection()
+
+    def test_should_search_after_sort_values(self):
+        self.es.search.return_value = {'hits': {'hits': []}}
+
+        self.db.fetch_document('sqapi', {'id': 1}, sort=[{'id': 'asc'}], search_after=[1])
+
+        search = json.loads(self.es.search.call_args[1]['body'])
+        self.assertEqual([1], search['search_after'])
+        self.assertNotIn('from', search)
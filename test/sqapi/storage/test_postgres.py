@@ -0,0 +1,160 @@
+import time
+from contextlib import contextmanager
+from unittest import TestCase, mock
+
+import psycopg2
+
+from sqapi.storage.postgres import BufferedWriter, Database, _copy_value
+
+CONFIG = {'type': 'postgres', 'connection': {}}
+
+
+class FakeDatabase:
+    def __init__(self, available=True):
+        self.available = available
+        self.written = []
+
+    def _execute_values(self, query, rows, template=None, page_size=100, fetch=False):
+        if not self.available:
+            raise psycopg2.OperationalError('Database unavailable')
+
+        if any(row[1] is None for row in rows):
+            raise psycopg2.IntegrityError('null value violates not-null constraint')
+
+        self.written.extend(rows)
+
+
+class TestDatabase(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(Database, 'active_connection', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.con = mock.MagicMock()
+        self.db = Database(CONFIG)
+        self.db._pooled_connection = contextmanager(lambda: (yield self.con))
+
+    def test_should_escape_copy_values(self):
+        self.assertEqual('\\N', _copy_value(None))
+        self.assertEqual('a\\\\b\\tc\\nd\\re', _copy_value('a\\b\tc\nd\re'))
+        self.assertEqual('42', _copy_value(42))
+
+    def test_should_copy_rows_as_tab_separated_lines(self):
+        copied = []
+        cur = self.con.cursor.return_value.__enter__.return_value
+        cur.copy_expert.side_effect = lambda query, f: copied.append(f.read())
+
+        with mock.patch('psycopg2.sql.Composed.as_string', return_value='COPY'):
+            self.db.copy_rows('items', [(1, 'first\tline'), (2, None)], ['id', 'name'])
+
+        self.assertEqual(['1\tfirst\\tline\n2\t\\N\n'], copied)
+
+    @mock.patch('psycopg2.extras.execute_values')
+    def test_should_execute_many_in_a_single_transaction(self, execute_values):
+        self.db.execute_many('INSERT INTO items (id, name) VALUES %s', [(1, 'first'), (2, 'second')], page_size=1)
+
+        self.assertEqual([(1, 'first'), (2, 'second')], execute_values.call_args[0][2])
+        self.assertFalse(self.con.autocommit)
+        self.con.commit.assert_called_once()
+
+    @mock.patch('psycopg2.extras.execute_values', side_effect=psycopg2.IntegrityError('duplicate key'))
+    def test_should_roll_back_failed_execute_many(self, execute_values):
+        with self.assertRaises(ConnectionError):
+            self.db.execute_many('INSERT INTO items (id, name) VALUES %s', [(1, 'first')])
+
+        self.con.rollback.assert_called_once()
+        self.con.commit.assert_not_called()
+
+
+    def test_should_reuse_writer_of_the_same_query(self):
+        self.addCleanup(self.db.close)
+        query = 'INSERT INTO items (id, name) VALUES %s'
+
+        writer = self.db.buffered_writer(query)
+
+        self.assertIs(writer, self.db.buffered_writer(query))
+        self.assertIsNot(writer, self.db.buffered_writer(query, '(%s, %s)'))
+        self.assertEqual(2, len(self.db.writers))
+
+    def test_should_replace_closed_writer(self):
+        self.addCleanup(self.db.close)
+        query = 'INSERT INTO items (id, name) VALUES %s'
+
+        writer = self.db.buffered_writer(query)
+        writer.close()
+
+        self.assertIsNot(writer, self.db.buffered_writer(query))
+        self.assertEqual(1, len(self.db.writers))
+
+
+class TestPooledConnection(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(Database, 'active_connection', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.db = Database(CONFIG)
+        self.pool = mock.MagicMock()
+        self.db._get_pool = lambda: self.pool
+
+    @staticmethod
+    def _connection(responding=True):
+        con = mock.MagicMock(closed=0)
+        con.get_transaction_status.return_value = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        if not responding:
+            con.cursor.return_value.__enter__.return_value.execute.side_effect = psycopg2.OperationalError('closed')
+
+        return con
+
+    def test_should_replace_idle_connection_not_responding(self):
+        dead, fresh = self._connection(responding=False), self._connection()
+        self.pool.getconn.side_effect = [dead, fresh]
+        self.db.pool_used[id(dead)] = time.monotonic() - 60
+
+        with self.db._pooled_connection() as con:
+            self.assertIs(fresh, con)
+
+        self.pool.putconn.assert_any_call(dead, close=True)
+        self.pool.putconn.assert_called_with(fresh, close=False)
+
+    def test_should_not_probe_recently_used_connection(self):
+        con = self._connection(responding=False)
+        self.pool.getconn.return_value = con
+        self.db.pool_used[id(con)] = time.monotonic()
+
+        with self.db._pooled_connection() as pooled:
+            self.assertIs(con, pooled)
+
+        con.cursor.assert_not_called()
+
+
+class TestBufferedWriter(TestCase):
+    def _writer(self, database, max_rows=10):
+        return BufferedWriter(database, 'INSERT INTO items (id, name) VALUES %s', None, 100, 60000, max_rows)
+
+    def test_should_drop_rows_rejected_by_the_database(self):
+        database = FakeDatabase()
+        writer = self._writer(database)
+
+        writer.write((1, 'first'), (2, None), (3, 'third'), (4, 'fourth'), (5, None))
+        writer.flush()
+
+        self.assertEqual([(1, 'first'), (3, 'third'), (4, 'fourth')], database.written)
+        self.assertEqual([], writer.rows)
+
+    def test_should_keep_rows_when_database_is_unavailable(self):
+        writer = self._writer(FakeDatabase(available=False))
+
+        writer.write((1, 'first'), (2, 'second'))
+        with self.assertRaises(ConnectionError):
+            writer.flush()
+
+        self.assertEqual([(1, 'first'), (2, 'second')], writer.rows)
+
+    def test_should_refuse_rows_when_buffer_is_full(self):
+        writer = self._writer(FakeDatabase(available=False), max_rows=2)
+
+        writer.write((1, 'first'), (2, 'second'))
+
+        with self.assertRaises(ConnectionError):
+            writer.write((3, 'third'))